@@ -0,0 +1,130 @@
+"""
+Generates synthetic MovieLens-like ratings.csv, tags.csv, movies.csv and links.csv.
+
+    python -m benchmarks.generate --size 1m --out /tmp/ml-1m
+
+The number of movies, users and tags follows the proportions of ml-25m. The popularity of the
+movies, the activity of the users and the popularity of the tags are Zipf distributed, so there
+are a few movies with a huge number of ratings and a long tail of rare ones. The IMDb details of
+the movies are written into an ImdbFetcher cache in <out>/cache, so Links never hits the network.
+"""
+import os
+import json
+import bisect
+import random
+import argparse
+import itertools
+
+SIZES = {'100k': 100000, '1m': 1000000, '25m': 25000000}
+GENRES = ['Action', 'Adventure', 'Animation', 'Children', 'Comedy', 'Crime', 'Documentary', 'Drama',
+          'Fantasy', 'Film-Noir', 'Horror', 'IMAX', 'Musical', 'Mystery', 'Romance', 'Sci-Fi', 'Thriller',
+          'War', 'Western']
+RATINGS = ['0.5', '1.0', '1.5', '2.0', '2.5', '3.0', '3.5', '4.0', '4.5', '5.0']
+RATING_WEIGHTS = [1.6, 3.1, 1.6, 6.6, 5.1, 19.6, 12.7, 26.6, 8.8, 14.4]
+WORDS = ['dark', 'comedy', 'funny', 'twist', 'ending', 'classic', 'sci-fi', 'atmospheric', 'great', 'dialogue',
+         'visually', 'appealing', 'thought-provoking', 'based', 'on', 'a', 'book', 'so', 'bad', "it's", 'good',
+         'Oscar', '(Best', 'Picture)', 'anime', 'violence', 'surreal', 'quirky', 'soundtrack', 'boring']
+FIRST_TIMESTAMP = 789652009
+LAST_TIMESTAMP = 1574327703
+
+
+def get_zipf_sampler(generator, count, exponent=1.0):
+    """
+    Returns a function drawing numbers 0..count-1, where the number k has the weight 1 / (k + 1) ** exponent
+    """
+    weights = list(itertools.accumulate(1 / (k + 1) ** exponent for k in range(count)))
+    total = weights[-1]
+    return lambda: bisect.bisect_left(weights, generator.random() * total)
+
+
+def get_counts(rows):
+    """
+    The number of movies, users and tags of a dataset with the given number of ratings, as in ml-25m
+    """
+    return max(rows // 400, 20), max(rows // 150, 10), max(rows // 25, 10)
+
+
+def write_movies(out, movies_count, generator):
+    with open(os.path.join(out, 'movies.csv'), 'w') as f:
+        f.write('movieId,title,genres\n')
+        for movie_id in range(1, movies_count + 1):
+            year = generator.randint(1902, 2019)
+            title = f"Movie {movie_id} ({year})"
+            if movie_id % 17 == 0:
+                title = f'"Movie {movie_id}, The ({year})"'
+            elif movie_id % 101 == 0:
+                title = f"Movie {movie_id}"
+            if movie_id % 211 == 0:
+                genres = '(no genres listed)'
+            else:
+                genres = '|'.join(sorted(generator.sample(GENRES, generator.randint(1, 5))))
+            f.write(f"{movie_id},{title},{genres}\n")
+
+
+def write_ratings(out, rows, movies_count, users_count, generator):
+    movie_sampler = get_zipf_sampler(generator, movies_count)
+    user_sampler = get_zipf_sampler(generator, users_count, 0.6)
+    ratings = generator.choices(RATINGS, RATING_WEIGHTS, k=1024)
+    with open(os.path.join(out, 'ratings.csv'), 'w') as f:
+        f.write('userId,movieId,rating,timestamp\n')
+        for start in range(0, rows, 100000):
+            lines = [f"{user_sampler() + 1},{movie_sampler() + 1},{ratings[generator.getrandbits(10)]},"
+                     f"{generator.randint(FIRST_TIMESTAMP, LAST_TIMESTAMP)}\n"
+                     for _ in range(min(100000, rows - start))]
+            f.writelines(lines)
+
+
+def write_tags(out, tags_count, movies_count, users_count, generator):
+    vocabulary = sorted({' '.join(generator.sample(WORDS, generator.randint(1, 4)))
+                         for _ in range(max(tags_count // 15, 10))})
+    generator.shuffle(vocabulary)
+    tag_sampler = get_zipf_sampler(generator, len(vocabulary))
+    movie_sampler = get_zipf_sampler(generator, movies_count)
+    with open(os.path.join(out, 'tags.csv'), 'w') as f:
+        f.write('userId,movieId,tag,timestamp\n')
+        for _ in range(tags_count):
+            f.write(f"{generator.randint(1, users_count)},{movie_sampler() + 1},{vocabulary[tag_sampler()]},"
+                    f"{generator.randint(FIRST_TIMESTAMP, LAST_TIMESTAMP)}\n")
+
+
+def write_links(out, movies_count, generator):
+    directors = [f"Director {k}" for k in range(max(movies_count // 5, 1))]
+    director_sampler = get_zipf_sampler(generator, len(directors))
+    imdb_cache = os.path.join(out, 'cache', 'imdb')
+    os.makedirs(imdb_cache, exist_ok=True)
+    with open(os.path.join(out, 'links.csv'), 'w') as f:
+        f.write('movieId,imdbId,tmdbId\n')
+        for movie_id in range(1, movies_count + 1):
+            imdb_id = f"{100000 + movie_id:07d}"
+            f.write(f"{movie_id},{imdb_id},{movie_id + 5000}\n")
+            budget = generator.randint(1, 300) * 1000000
+            record = [f"Movie {movie_id}", directors[director_sampler()], str(budget),
+                      str(int(budget * generator.lognormvariate(0.5, 1))), f"{generator.randint(60, 200)} min"]
+            with open(os.path.join(imdb_cache, f"{imdb_id}.json"), 'w') as record_file:
+                json.dump(record, record_file)
+
+
+def generate(out, rows, seed=0):
+    """
+    Writes the four files of a dataset with the given number of ratings into out
+    """
+    generator = random.Random(seed)
+    movies_count, users_count, tags_count = get_counts(rows)
+    os.makedirs(out, exist_ok=True)
+    write_movies(out, movies_count, generator)
+    write_ratings(out, rows, movies_count, users_count, generator)
+    write_tags(out, tags_count, movies_count, users_count, generator)
+    write_links(out, movies_count, generator)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', choices=sorted(SIZES), default='100k')
+    parser.add_argument('--out', required=True)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate(args.out, SIZES[args.size], args.seed)
+
+
+if __name__ == "__main__":
+    main()
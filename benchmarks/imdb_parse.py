@@ -0,0 +1,45 @@
+"""
+Per-page parse time of the IMDb extractors over the saved pages in fixtures/imdb.
+
+    python -m benchmarks.imdb_parse [--repeat 20]
+"""
+import os
+import glob
+import time
+import argparse
+
+from movielens_analysis import parse_imdb_page_fast, parse_imdb_page_soup
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'fixtures', 'imdb')
+
+
+def time_parser(parser, pages, repeat):
+    """
+    Returns the best time of parsing all the pages over repeat runs, per page in seconds
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for page in pages:
+            parser(page)
+        best = min(best, time.perf_counter() - start)
+    return best / len(pages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    pages = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, '*.html'))):
+        with open(path, 'r') as f:
+            pages.append(f.read())
+    soup_time = time_parser(parse_imdb_page_soup, pages, args.repeat)
+    fast_time = time_parser(parse_imdb_page_fast, pages, args.repeat)
+    print(f"pages: {len(pages)}")
+    print(f"soup: {soup_time * 1e6:10.1f} us/page")
+    print(f"fast: {fast_time * 1e6:10.1f} us/page ({soup_time / fast_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
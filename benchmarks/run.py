@@ -0,0 +1,215 @@
+"""
+Times every public method of Ratings.Movies, Ratings.Users, Tags, Movies and Links on a generated
+dataset, records the peak memory of every step and compares the results with the stored baseline.
+Exits with 1 if a step got slower or bigger than the baseline allows.
+
+    python -m benchmarks.run --size 100k
+    python -m benchmarks.run --size 1m --update-baseline
+
+The report runs --repeat times, every time on fresh objects, the way a report calls the steps,
+and every step keeps its best time. The peak memory (tracemalloc) comes from one more pass,
+so tracing does not skew the timings. A fixed pure Python workload is timed as the calibration
+step and the baseline times are scaled up by it on a slower machine, so a baseline from another
+machine still applies. Slowdowns below --noise seconds are ignored.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+import movielens_analysis
+from movielens_analysis import Ratings, Tags, Movies, Links, ImdbFetcher
+from benchmarks.generate import SIZES, generate
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+UNREACHABLE_URL = 'http://127.0.0.1:9/title/tt{}/'
+REPEAT = 5
+NOISE_SECONDS = 0.001
+CALIBRATION = 'calibration'
+
+
+def get_steps(data):
+    """
+    Returns the steps of a full report as (name, function) pairs, the functions share their objects
+    """
+    state = {}
+
+    def path(name):
+        return os.path.join(data, name)
+
+    def construct(name, function):
+        def step():
+            state[name] = function()
+        return step
+
+    def call(name, method, *args):
+        return lambda: getattr(state[name], method)(*args)
+
+    fetcher = lambda: ImdbFetcher(base_url=UNREACHABLE_URL, retries=0, cache_dir=path('cache'))
+    return [
+        ('Ratings', construct('ratings', lambda: Ratings(path('ratings.csv')))),
+        ('Ratings.get_summary', call('ratings', 'get_summary')),
+        ('Ratings.Movies', construct('movies', lambda: state['ratings'].Movies(path('movies.csv'), state['ratings']))),
+        ('Ratings.Movies.dist_by_year', call('movies', 'dist_by_year')),
+        ('Ratings.Movies.dist_by_rating', call('movies', 'dist_by_rating')),
+        ('Ratings.get_time_index', call('ratings', 'get_time_index')),
+        ('Ratings.Movies.dist_by_rating[range]', call('movies', 'dist_by_rating', 1200000000, 1300000000)),
+        ('Ratings.Movies.dist_by_month[range]', call('movies', 'dist_by_month', 1200000000, 1300000000)),
+        ('Ratings.Movies.top_by_num_of_ratings', call('movies', 'top_by_num_of_ratings', 10)),
+        ('Ratings.Movies.top_by_ratings', call('movies', 'top_by_ratings', 10)),
+        ('Ratings.Movies.top_by_ratings[median]', call('movies', 'top_by_ratings', 10, 'median')),
+        ('Ratings.Movies.top_controversial', call('movies', 'top_controversial', 10)),
+        ('Ratings.Users', construct('users', lambda: state['ratings'].Users(state['ratings']))),
+        ('Ratings.Users.top_valuers', call('users', 'top_valuers')),
+        ('Ratings.Users.valuers_with_ratings', call('users', 'valuers_with_ratings')),
+        ('Ratings.Users.valuers_with_ratings[median]', call('users', 'valuers_with_ratings', 'median')),
+        ('Ratings.Users.top_controversial_valuers', call('users', 'top_controversial_valuers', 10)),
+        ('Tags', construct('tags', lambda: Tags(path('tags.csv')))),
+        ('Tags.most_words', call('tags', 'most_words', 10)),
+        ('Tags.longest', call('tags', 'longest', 10)),
+        ('Tags.most_words_and_longest', call('tags', 'most_words_and_longest', 10)),
+        ('Tags.most_popular', call('tags', 'most_popular', 10)),
+        ('Tags.tags_with', call('tags', 'tags_with', 'fun')),
+        ('Movies', construct('movies_file', lambda: Movies(path('movies.csv')))),
+        ('Movies.dist_by_release', call('movies_file', 'dist_by_release')),
+        ('Movies.dist_by_genres', call('movies_file', 'dist_by_genres')),
+        ('Movies.most_genres', call('movies_file', 'most_genres', 10)),
+        ('Links', construct('links', lambda: Links(path('links.csv'), fetcher()))),
+        ('Links.get_imdb', call('links', 'get_imdb')),
+        ('Links.top_directors', call('links', 'top_directors', 10)),
+        ('Links.most_expensive', call('links', 'most_expensive', 10)),
+        ('Links.most_profitable', call('links', 'most_profitable', 10)),
+        ('Links.longest', call('links', 'longest', 10)),
+        ('Links.top_cost_per_minute', call('links', 'top_cost_per_minute', 10)),
+    ]
+
+
+def get_fresh_steps(data):
+    """
+    Returns the steps of a report that shares nothing with the reports run before
+    """
+    movielens_analysis.MOVIE_INDEXES.clear()
+    return get_steps(data)
+
+
+def calibrate():
+    """
+    Times a fixed pure Python workload, a measure of the speed of the machine
+    """
+    start = time.perf_counter()
+    counts = {}
+    for i in range(200000):
+        counts[i % 1000] = counts.get(i % 1000, 0) + i
+    sorted(counts.values())
+    return time.perf_counter() - start
+
+
+def measure(data, repeat=REPEAT):
+    """
+    Returns {step: {"seconds": ..., "peak_bytes": ...}} for all the steps of a report on data,
+    the seconds are the best of repeat runs. The calibration step comes first, it is timed before every run.
+    """
+    results = {CALIBRATION: {"seconds": float("inf"), "peak_bytes": 0}}
+    for _ in range(repeat):
+        results[CALIBRATION]["seconds"] = min(results[CALIBRATION]["seconds"], calibrate())
+        for name, step in get_fresh_steps(data):
+            start = time.perf_counter()
+            step()
+            seconds = time.perf_counter() - start
+            result = results.setdefault(name, {"seconds": seconds})
+            result["seconds"] = min(result["seconds"], seconds)
+    tracemalloc.start()
+    try:
+        for name, step in get_fresh_steps(data):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            step()
+            results[name]["peak_bytes"] = tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return results
+
+
+def get_scale(results, baseline):
+    """
+    Returns how much slower this machine is than the machine of the baseline, by their calibrations.
+    A faster machine is not scaled down: the calibration follows the steps too loosely for that,
+    and a looser gate only misses small regressions while a stricter one fails on noise.
+    """
+    if CALIBRATION not in results or CALIBRATION not in baseline:
+        return 1.0
+    return max(1.0, results[CALIBRATION]["seconds"] / baseline[CALIBRATION]["seconds"])
+
+
+def compare(results, baseline, tolerance, memory_tolerance, noise=NOISE_SECONDS):
+    """
+    Returns the regressions against the baseline, its times scaled by get_scale.
+    Differences below noise seconds or 1 MB are noise.
+    """
+    regressions = []
+    scale = get_scale(results, baseline)
+    for name, result in results.items():
+        if name not in baseline or name == CALIBRATION:
+            continue
+        seconds, base_seconds = result["seconds"], baseline[name]["seconds"] * scale
+        if seconds > base_seconds * (1 + tolerance) and seconds - base_seconds > noise:
+            regressions.append(f"{name}: {seconds:.4f}s against {base_seconds:.4f}s")
+        peak, base_peak = result["peak_bytes"], baseline[name]["peak_bytes"]
+        if peak > base_peak * (1 + memory_tolerance) and peak - base_peak > 1 << 20:
+            regressions.append(f"{name}: {peak / 2 ** 20:.1f} MB against {base_peak / 2 ** 20:.1f} MB")
+    return regressions
+
+
+def get_data(size, seed):
+    data = os.path.join(tempfile.gettempdir(), f'movielens-bench-{size}-{seed}')
+    if not os.path.exists(os.path.join(data, 'links.csv')):
+        generate(data, SIZES[size], seed)
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', choices=sorted(SIZES), default='100k')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data', help='a directory with the four csv files, generated if it is not given')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed relative slowdown')
+    parser.add_argument('--memory-tolerance', type=float, default=0.2, help='allowed relative memory growth')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='runs of the report, the best time of a step counts')
+    parser.add_argument('--noise', type=float, default=NOISE_SECONDS, help='slowdowns below it in seconds are ignored')
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--json', help='write the results into this file')
+    args = parser.parse_args()
+
+    results = measure(args.data or get_data(args.size, args.seed), args.repeat)
+    baselines = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, 'r') as f:
+            baselines = json.load(f)
+    baseline = baselines.get(args.size, {})
+    scale = get_scale(results, baseline)
+
+    print(f"{'step':<46}{'seconds':>10}{'baseline':>10}{'peak MB':>10}")
+    for name, result in results.items():
+        base = baseline.get(name, {}).get("seconds")
+        base = None if base is None else base * scale
+        print(f"{name:<46}{result['seconds']:>10.4f}{'' if base is None else f'{base:.4f}':>10}"
+              f"{result['peak_bytes'] / 2 ** 20:>10.2f}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.update_baseline:
+        baselines[args.size] = results
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(baselines, f, indent=1, sort_keys=True)
+        return 0
+    regressions = compare(results, baseline, args.tolerance, args.memory_tolerance, args.noise)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,429 +1,3185 @@
 import os
 import sys
+import copy
+import functools
+import inspect
+import contextlib
+import json
+import mmap
+import hashlib
+import threading
+import time
+import calendar
+import bisect
+import math
+import array
 import collections
-import requests
-import bs4
+import collections.abc
+import heapq
+import itertools
+import csv
+import io
+import http
+import urllib.parse
 import re
+import html
+
+
+def get_writable(column):
+    """
+    Returns the column itself if it is an array, or an array copy of a read-only memoryview column
+    """
+    if isinstance(column, array.array):
+        return column
+    writable = array.array(column.format)
+    writable.frombytes(column.cast('B'))
+    return writable
+
+
+def get_generator_tail_lines(file_name, offset):
+    """
+    Yields the complete lines of a file after the byte offset, together with the offset after each line.
+    A last line without the line end is still being written and is left for the next time.
+    """
+    with open(file_name, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b'\n'):
+                return
+            offset += len(line)
+            yield line.decode().replace('\r\n', '\n'), offset
+
+
+def get_byte_ranges(file_name, parts, size=None):
+    """
+    Splits a csv file after its header into at most parts byte ranges of about the same size.
+    The ranges are aligned to line boundaries: a range holds the lines which start inside it.
+    With size only the first size bytes of the file are split.
+    """
+    with open(file_name, 'rb') as f:
+        f.readline()
+        begin = f.tell()
+        if size is None:
+            size = os.fstat(f.fileno()).st_size
+        bounds = [begin]
+        for part in range(1, parts):
+            f.seek(max(begin + (size - begin) * part // parts - 1, bounds[-1]))
+            f.readline()
+            bounds.append(min(f.tell(), size))
+        bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
+
+
+def get_generator_blocks(file_name, start=None, end=None, block_size=None):
+    """
+    Reads a csv file in binary blocks of about block_size bytes (BLOCK_SIZE by default) and yields
+    them decoded, each one made of whole lines with the line ends as "\\n". Without start the header
+    is skipped, with start and end only the byte range is read, see get_byte_ranges.
+    """
+    block_size = block_size or BLOCK_SIZE
+    with open(file_name, 'rb') as f:
+        if start is None:
+            f.readline()
+            start = f.tell()
+        else:
+            f.seek(start)
+        if end is None:
+            end = os.fstat(f.fileno()).st_size
+        position, rest = start, b''
+        while position < end:
+            data = f.read(min(block_size, end - position))
+            if not data:
+                break
+            position += len(data)
+            data = rest + data
+            cut = data.rfind(b'\n') + 1
+            if position < end and cut == 0:
+                rest = data
+                continue
+            if position >= end:
+                cut = len(data)
+            rest = data[cut:]
+            yield data[:cut].decode().replace('\r\n', '\n')
+        if rest:
+            yield rest.decode().replace('\r\n', '\n')
+
+
+MALFORMED_EXAMPLES = 5
+
+
+class MalformedRows(object):
+    """
+    The rows of a file which could not be parsed and were skipped: their numbers by the reason
+    ("fields" for a wrong number of fields, "value" for a field which is not a number or out of range)
+    and the first MALFORMED_EXAMPLES of them
+    """
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.examples = []
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def add(self, reason, row):
+        self.counts[reason] += 1
+        if len(self.examples) < MALFORMED_EXAMPLES:
+            self.examples.append(row)
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        self.examples.extend(other.examples[:MALFORMED_EXAMPLES - len(self.examples)])
+
+    def report(self, path):
+        if self.counts:
+            print(f"Skipped {len(self)} malformed rows of {path}: {dict(self.counts)}")
+
+
+def get_csv_rows(text, fields, malformed):
+    """
+    Yields the rows of the csv text with the RFC 4180 quoting, skipping the blank lines.
+    The rows with less than fields fields are counted as malformed.
+    """
+    for row in csv.reader(io.StringIO(text)):
+        if not row or row == ['']:
+            continue
+        if len(row) < fields:
+            malformed.add("fields", row)
+            continue
+        yield row
+
+
+def append_row(columns, values, malformed, row):
+    """
+    Appends the values to the columns, or counts the row as malformed if a value does not fit its column.
+    Returns whether the row was appended.
+    """
+    size = len(columns[0])
+    try:
+        for column, value in zip(columns, values):
+            column.append(value)
+    except OverflowError:
+        for column in columns:
+            del column[size:]
+        malformed.add("value", row)
+        return False
+    return True
+
+
+CACHE_MAGIC = b'MLCACHE1'
+CACHE_VERSION = 1
+
+
+def get_cache_dir(cache_dir=None):
+    """
+    The directory of the binary caches: the argument, else the MOVIELENS_CACHE_DIR environment
+    variable. None means that caching is off.
+    """
+    return cache_dir or os.environ.get('MOVIELENS_CACHE_DIR') or None
+
+
+def get_cache_path(cache_dir, path, kind):
+    name = hashlib.sha1(f"{os.path.abspath(path)}:{kind}".encode()).hexdigest()
+    return os.path.join(cache_dir, f"{kind}-{name}.mlc")
+
+
+def get_file_signature(path):
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def store_cache(cache_dir, path, kind, signature, columns, meta=None):
+    """
+    Writes the parsed columns of a csv file into one binary container:
+    the magic, the length of a json header, the header, then every column's raw bytes
+    aligned to 8 bytes. The header keeps the file's path, size and mtime, so a cache
+    of a changed file is seen as stale. The file is replaced atomically.
+    A cache that can not be written is reported and skipped, the data is still there in memory.
+    Returns whether the cache was written.
+    """
+    header = {"version": CACHE_VERSION, "kind": kind, "source": signature, "meta": meta or {}, "columns": {}}
+    offset = 0
+    for name, column in columns.items():
+        header["columns"][name] = {"typecode": column.typecode, "offset": offset, "length": len(column)}
+        offset += (len(column) * column.itemsize + 7) // 8 * 8
+    header_bytes = json.dumps(header).encode()
+    header_bytes += b' ' * (-(len(CACHE_MAGIC) + 8 + len(header_bytes)) % 8)
+    cache_path = get_cache_path(cache_dir, path, kind)
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(temp_path, 'wb') as f:
+            f.write(CACHE_MAGIC)
+            f.write(len(header_bytes).to_bytes(8, 'little'))
+            f.write(header_bytes)
+            for column in columns.values():
+                data = column.tobytes()
+                f.write(data)
+                f.write(bytes(-len(data) % 8))
+        os.replace(temp_path, cache_path)
+    except OSError as error:
+        print(f"Could not write the {kind} cache of {path}: {error}")
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        return False
+    return True
+
+
+def load_cache(cache_dir, path, kind):
+    """
+    Memory-maps the cache of a csv file. Returns the columns as read-only memoryviews over
+    the mapping (no copying) and the meta dict, or None if there is no fresh cache.
+    """
+    try:
+        f = open(get_cache_path(cache_dir, path, kind), 'rb')
+    except OSError:
+        return None
+    with f:
+        try:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+    try:
+        if mapping[:len(CACHE_MAGIC)] != CACHE_MAGIC:
+            return None
+        header_length = int.from_bytes(mapping[len(CACHE_MAGIC):len(CACHE_MAGIC) + 8], 'little')
+        begin = len(CACHE_MAGIC) + 8 + header_length
+        header = json.loads(mapping[len(CACHE_MAGIC) + 8:begin])
+    except ValueError:
+        return None
+    if header.get("version") != CACHE_VERSION or header.get("source") != get_file_signature(path):
+        return None
+    view = memoryview(mapping)
+    columns = {}
+    for name, column in header["columns"].items():
+        start = begin + column["offset"]
+        size = array.array(column["typecode"]).itemsize * column["length"]
+        columns[name] = view[start:start + size].cast(column["typecode"])
+    return columns, header["meta"]
+
+
+def pack_strings(strings):
+    """
+    Packs strings into a utf-8 blob and the offsets of their ends, to be stored as columns
+    """
+    blob, ends = array.array('B'), array.array('q')
+    for string in strings:
+        blob.frombytes(string.encode())
+        ends.append(len(blob))
+    return blob, ends
+
+
+def unpack_strings(blob, ends):
+    data = bytes(blob)
+    start, strings = 0, []
+    for end in ends:
+        strings.append(data[start:end].decode())
+        start = end
+    return strings
+
+
+def top_n(items, n, key):
+    """
+    Returns the n items with the biggest key, biggest first. A bounded heap keeps it O(N log n).
+    Items with equal keys stay in the order they come in, exactly as sorted(..., reverse=True)[:n]
+    would leave them, so rankings are deterministic: ties go to the key seen first in the file.
+    With n=None all the items are returned sorted.
+    """
+    if n is None:
+        return sorted(items, key=key, reverse=True)
+    return heapq.nlargest(n, items, key=key)
+
+
+INSTRUMENTATION = None
+
+
+class Instrumentation(object):
+    """
+    Sends an event for every call of the instrumented methods to the sink, a callable taking
+    a dict: the name of the method, its wall time in seconds, the rows the call processed as the
+    method reports them with count_rows (0 for a result from the memo, the ratings in the range
+    for a time range query, the groups or the vocabulary ranked for a ranking, None if the method
+    reports none), the dataset_rows of the instance (the size of the data it holds), whether
+    the result came from the memo, and with memory=True the peak of the memory allocated
+    during the call as traced by tracemalloc. tracemalloc has one peak per process, so only the
+    outermost instrumented call of a thread measures it.
+    """
+
+    def __init__(self, sink, memory=False):
+        self.sink = sink
+        self.memory = memory
+        self.local = threading.local()
+
+    def call(self, name, method, instance, args, kwargs):
+        local = self.local
+        depth = getattr(local, 'depth', 0)
+        trace = self.memory and depth == 0
+        if trace:
+            import tracemalloc
+        started = trace and not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        elif trace:
+            tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0] if trace else 0
+        rows = getattr(local, 'rows', None)
+        local.depth, local.cached, local.rows = depth + 1, False, None
+        start = time.perf_counter()
+        try:
+            return method(instance, *args, **kwargs)
+        finally:
+            event = {"name": name, "seconds": time.perf_counter() - start, "rows": local.rows,
+                     "dataset_rows": getattr(instance, 'rows', None), "cached": local.cached}
+            local.depth, local.cached, local.rows = depth, False, rows
+            if trace:
+                event["peak_bytes"] = tracemalloc.get_traced_memory()[1] - base
+                if started:
+                    tracemalloc.stop()
+            self.sink(event)
+
+
+def set_instrumentation(sink=None, memory=False):
+    """
+    Turns the instrumentation on with the sink, or off with None, and returns the previous one
+    """
+    global INSTRUMENTATION
+    previous = INSTRUMENTATION
+    INSTRUMENTATION = None if sink is None else Instrumentation(sink, memory)
+    return previous
+
+
+@contextlib.contextmanager
+def instrumentation(sink, memory=False):
+    """
+    Instruments the calls made in the block, see Instrumentation
+    """
+    global INSTRUMENTATION
+    previous = set_instrumentation(sink, memory)
+    try:
+        yield INSTRUMENTATION
+    finally:
+        INSTRUMENTATION = previous
+
+
+def emit_event(event):
+    instrumentation = INSTRUMENTATION
+    if instrumentation is not None:
+        instrumentation.sink(event)
+
+
+def mark_cached():
+    instrumentation = INSTRUMENTATION
+    if instrumentation is not None:
+        instrumentation.local.cached = True
+        instrumentation.local.rows = 0
+
+
+def count_rows(rows):
+    """
+    Adds rows to the rows processed by the current instrumented call
+    """
+    instrumentation = INSTRUMENTATION
+    if instrumentation is not None:
+        local = instrumentation.local
+        local.rows = (getattr(local, 'rows', None) or 0) + rows
+
+
+def instrumented(method):
+    """
+    Reports the calls of the method when the instrumentation is on. When it is off the cost
+    is one global lookup per call.
+    """
+    name = method.__qualname__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        instrumentation = INSTRUMENTATION
+        if instrumentation is None:
+            return method(self, *args, **kwargs)
+        return instrumentation.call(name, method, self, args, kwargs)
+
+    return wrapper
+
+
+class StatsSink(object):
+    """
+    Keeps the events in memory. summary sums them up per name: the number of calls and the sums
+    of the numbers, rows included, but the maximum of dataset_rows and peak_bytes.
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, event):
+        self.events.append(event)
+
+    def summary(self):
+        summary = collections.OrderedDict()
+        for event in self.events:
+            stats = summary.setdefault(event["name"], {"calls": 0})
+            stats["calls"] += 1
+            for key, value in event.items():
+                if key == "name" or value is None:
+                    continue
+                if key in ("dataset_rows", "peak_bytes"):
+                    stats[key] = max(stats.get(key, 0), value)
+                else:
+                    stats[key] = stats.get(key, 0) + value
+        return summary
+
+
+class LoggingSink(object):
+    """
+    Logs every event as json, by default to the movielens_analysis logger at the INFO level
+    """
+
+    def __init__(self, logger=None, level=None):
+        import logging
+        self.logger = logger if logger is not None else logging.getLogger('movielens_analysis')
+        self.level = logging.INFO if level is None else level
+
+    def __call__(self, event):
+        self.logger.log(self.level, json.dumps(event))
+
+
+class JsonLinesSink(object):
+    """
+    Appends every event to a file as a line of json
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+        line = json.dumps(event) + '\n'
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+
+
+@contextlib.contextmanager
+def profiled(path=None, stream=None, sort="cumulative", limit=20):
+    """
+    Profiles the block with cProfile. The stats are dumped to path if it is given,
+    otherwise the limit most expensive functions by sort are printed to stream (stdout by default).
+    """
+    import cProfile
+    import pstats
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield profile
+    finally:
+        profile.disable()
+        if path is not None:
+            profile.dump_stats(path)
+        else:
+            pstats.Stats(profile, stream=stream or sys.stdout).sort_stats(sort).print_stats(limit)
+
+
+MEMO_SIZE = 128
+
+
+class Memo(object):
+    """
+    The results of the memoized methods of one object for one version of its data,
+    the least recently used result is dropped when there are more than size of them.
+    It can be shared by threads.
+    """
+
+    def __init__(self, version, size=MEMO_SIZE):
+        self.version = version
+        self.size = size
+        self.results = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            result = self.results.get(key)
+            if result is not None:
+                self.results.move_to_end(key)
+            return result
+
+    def put(self, key, result):
+        with self.lock:
+            self.results[key] = result
+            self.results.move_to_end(key)
+            if len(self.results) > self.size:
+                self.results.popitem(last=False)
+
+
+def get_memo(instance):
+    """
+    Returns the memo of the instance, a new one if its data changed. The data of an instance
+    is versioned by its version attribute, which append and tail increase.
+    """
+    version = getattr(instance, 'version', 0)
+    memo = instance.__dict__.get('memo')
+    if memo is None or memo.version != version:
+        memo = instance.__dict__['memo'] = Memo(version)
+    return memo
+
+
+def clear_memo(instance):
+    """
+    Drops the memoized results of the instance, for changes its version does not count
+    """
+    instance.__dict__.pop('memo', None)
+
+
+def get_head(result, n):
+    if isinstance(result, dict):
+        return result.__class__(itertools.islice(result.items(), n))
+    return result[:n]
+
+
+def memoized(method=None, top=False):
+    """
+    Memoizes the results of a method per instance, keyed on the arguments. Shallow copies
+    of the results are returned, so the callers can change them.
+
+    With top=True the method's first argument is the n of a top n, and the result of a bigger n
+    serves the smaller ones: the top n is the head of the top m for m > n, as top_n keeps the ties
+    in order. This holds only when the result has m items, otherwise some of them could have been
+    merged under the same key (the same title for example) or the data could have less than m items.
+    The calls with another n than None or a non-negative integer are not memoized either, so the memo
+    does not change what they return.
+    The calls with unhashable arguments are not memoized.
+    The memoized methods are instrumented as well, see instrumented.
+    """
+    if method is None:
+        return functools.partial(memoized, top=top)
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        arguments = signature.bind(self, *args, **kwargs)
+        arguments.apply_defaults()
+        values = tuple(arguments.arguments.values())[1:]
+        n, key = (values[0], (method.__name__,) + values[1:]) if top else (None, (method.__name__,) + values)
+        if n is not None and not (isinstance(n, int) and n >= 0):
+            return method(self, *args, **kwargs)
+        try:
+            hash(key)
+        except TypeError:
+            return method(self, *args, **kwargs)
+        memo = get_memo(self)
+        cached = memo.get(key)
+        if cached is not None:
+            cached_n, result = cached
+            if cached_n == n:
+                mark_cached()
+                return copy.copy(result)
+            if n is not None and cached_n is not None and n < cached_n and len(result) == cached_n:
+                mark_cached()
+                return get_head(result, n)
+        result = method(self, *args, **kwargs)
+        memo.put(key, (n, result))
+        return copy.copy(result)
+
+    return instrumented(wrapper)
+
+
+def encode_rating(rating) -> int:
+    """
+    Ratings are half-star values from 0.5 to 5.0, so they are stored as small integer codes 1..10.
+    Raises ValueError for any other value.
+    """
+    code = float(rating) * 2
+    if not code.is_integer() or not 1 <= code <= RATING_CODES:
+        raise ValueError(f"{rating!r} is not a half-star rating from 0.5 to 5.0")
+    return int(code)
+
+
+def decode_rating(code) -> str:
+    """
+    Turns a rating code back into the rating as it is written in ratings.csv
+    """
+    return f"{code / 2:.1f}"
+
+
+def get_rating_distribution(counts):
+    """
+    Turns the counts of the rating codes into a dict of ratings and counts, sorted by ratings ascendingly
+    """
+    return collections.OrderedDict((decode_rating(code), counts[code - 1])
+                                   for code in range(1, len(counts) + 1) if counts[code - 1])
+
+
+RATING_CODES = 10
+RATING_CODES_BY_VALUE = {code / 2: code for code in range(1, RATING_CODES + 1)}
+BLOCK_SIZE = 1 << 20
+CHUNK_SIZE = BLOCK_SIZE
+DAY_SECONDS = 86400
+TIME_UNITS = ("year", "month", "day")
+TIME_BLOCK = 4096
+
+
+def get_time_bucket(timestamp, unit):
+    """
+    The calendar bucket of a unix timestamp in UTC: the year as an int, the month as "YYYY-MM"
+    or the day as "YYYY-MM-DD", so that sorting the buckets sorts them by time
+    """
+    moment = time.gmtime(timestamp)
+    if unit == "year":
+        return moment.tm_year
+    if unit == "month":
+        return f"{moment.tm_year:04d}-{moment.tm_mon:02d}"
+    if unit == "day":
+        return f"{moment.tm_year:04d}-{moment.tm_mon:02d}-{moment.tm_mday:02d}"
+    raise ValueError(f"Unknown time unit {unit}, use one of {', '.join(TIME_UNITS)}")
+
+
+def get_next_time_bucket(timestamp, unit):
+    """
+    Returns the timestamp where the bucket after the one of the timestamp starts
+    """
+    moment = time.gmtime(timestamp)
+    if unit == "year":
+        return calendar.timegm((moment.tm_year + 1, 1, 1, 0, 0, 0))
+    if unit == "month":
+        return calendar.timegm((moment.tm_year + moment.tm_mon // 12, moment.tm_mon % 12 + 1, 1, 0, 0, 0))
+    return (timestamp // DAY_SECONDS + 1) * DAY_SECONDS
+
+
+def parse_ratings_text(text, malformed=None):
+    """
+    Parses csv text of ratings.csv into the columns user_ids, movie_ids, rating_codes and timestamps.
+
+    All the fields are numbers, so when every line of the text has four fields the text is decoded
+    at once as a json array, without a string object per field, and the columns are sliced out of it.
+    This is kept only when there are four numbers per line, ids and timestamps are integers and
+    ratings are half stars. Otherwise the text is parsed row by row and the malformed rows
+    are skipped and counted in malformed.
+    """
+    malformed = MalformedRows() if malformed is None else malformed
+    text = text.rstrip('\n')
+    lines = text.split('\n')
+    if text and set(map(str.count, lines, itertools.repeat(','))) == {3}:
+        try:
+            values = json.loads('[' + ','.join(lines) + ']')
+            if len(values) == 4 * len(lines):
+                return (array.array('i', values[0::4]), array.array('i', values[1::4]),
+                        array.array('B', bytes(map(RATING_CODES_BY_VALUE.__getitem__, values[2::4]))),
+                        array.array('q', values[3::4]))
+        except (ValueError, TypeError, KeyError, OverflowError):
+            pass
+    columns = (array.array('i'), array.array('i'), array.array('B'), array.array('q'))
+    for row in get_csv_rows(text, 4, malformed):
+        try:
+            values = int(row[0]), int(row[1]), encode_rating(row[2]), int(row[3])
+        except (ValueError, OverflowError):
+            malformed.add("value", row)
+            continue
+        if len(row) > 4:
+            malformed.add("fields", row)
+        else:
+            append_row(columns, values, malformed, row)
+    return columns
+
+
+def parse_ratings_range(file_name, start, end, keep_columns, chunk_size=CHUNK_SIZE):
+    """
+    Parses and summarizes one byte range of ratings.csv, this runs in the worker processes.
+    Returns the columns of the range (None if keep_columns is false), its RatingsSummary
+    and its MalformedRows.
+    """
+    summary, malformed = RatingsSummary(), MalformedRows()
+    columns = (array.array('i'), array.array('i'), array.array('B'), array.array('q'))
+    for block in get_generator_blocks(file_name, start, end, chunk_size):
+        block_columns = parse_ratings_text(block, malformed)
+        summary.add_columns(*block_columns)
+        if keep_columns:
+            for column, values in zip(columns, block_columns):
+                column.extend(values)
+    return (columns if keep_columns else None), summary, malformed
+
+
+class RatingGroups(object):
+    """
+    Rating statistics grouped by a key (movieId or userId).
+
+    Ratings take only ten half-star values, so every group keeps a histogram of its rating codes.
+    The histogram is a counting-sort index of the group's values: order statistics are read from it
+    directly, and it is filled in a single pass over the columns. Counts, sums and sums of squares
+    are kept in rating codes, so they are exact integers.
+    """
+
+    def __init__(self):
+        self.index = {}
+        self.keys = array.array('i')
+        self.histograms = array.array('q')
+        self.counts = array.array('q')
+        self.sums = array.array('q')
+        self.squares = array.array('q')
+
+    def __len__(self):
+        return len(self.keys)
+
+    def group(self, key):
+        """
+        Returns the number of the key's group, groups are numbered in order of the key's first appearance
+        """
+        group = self.index.get(key)
+        if group is None:
+            group = self.index[key] = len(self.keys)
+            self.keys.append(key)
+            self.histograms.extend([0] * RATING_CODES)
+            self.counts.append(0)
+            self.sums.append(0)
+            self.squares.append(0)
+        return group
+
+    def add(self, key, code):
+        """
+        Adds one rating to the key's group, keeping all the statistics up to date in O(1)
+        """
+        group = self.group(key)
+        self.histograms[group * RATING_CODES + code - 1] += 1
+        self.counts[group] += 1
+        self.sums[group] += code
+        self.squares[group] += code * code
+
+    def summarize(self):
+        """
+        Recomputes counts, sums and sums of squares of every group from the histograms
+        """
+        histograms = self.histograms
+        for group in range(len(self.keys)):
+            offset = group * RATING_CODES
+            count = total = squares = 0
+            for code in range(1, RATING_CODES + 1):
+                number = histograms[offset + code - 1]
+                count += number
+                total += number * code
+                squares += number * code * code
+            self.counts[group] = count
+            self.sums[group] = total
+            self.squares[group] = squares
+
+    def histogram(self, group):
+        offset = group * RATING_CODES
+        return self.histograms[offset:offset + RATING_CODES]
+
+    @classmethod
+    def from_columns(cls, keys, histograms):
+        """
+        Restores the groups from their keys and histograms, as they are kept in the cache
+        """
+        groups = cls()
+        groups.keys.frombytes(memoryview(keys).cast('B'))
+        groups.histograms.frombytes(memoryview(histograms).cast('B'))
+        groups.index = dict(zip(groups.keys, range(len(groups.keys))))
+        groups.counts = array.array('q', bytes(8 * len(groups.keys)))
+        groups.sums = array.array('q', bytes(8 * len(groups.keys)))
+        groups.squares = array.array('q', bytes(8 * len(groups.keys)))
+        groups.summarize()
+        return groups
+
+    def add_histogram(self, key, histogram):
+        """
+        Adds the ratings counted in a histogram to the key's group, summarize has to be called after
+        """
+        offset = self.group(key) * RATING_CODES
+        for code in range(RATING_CODES):
+            self.histograms[offset + code] += histogram[code]
+
+    def merge(self, other):
+        """
+        Adds the histograms of other to this groups. The keys new to this groups are appended
+        in other's order, so merging the parts of a file in order keeps the order of first appearance.
+        """
+        for other_group, key in enumerate(other.keys):
+            self.add_histogram(key, other.histogram(other_group))
+
+    def minimum(self, group):
+        histogram = self.histogram(group)
+        return next(code for code in range(1, RATING_CODES + 1) if histogram[code - 1]) / 2
+
+    def maximum(self, group):
+        histogram = self.histogram(group)
+        return next(code for code in range(RATING_CODES, 0, -1) if histogram[code - 1]) / 2
+
+    def mean(self, group):
+        return self.sums[group] / 2 / self.counts[group]
+
+    def variance(self, group):
+        """
+        The sample variance of the group's ratings. A single rating is returned as it is,
+        the same way the original list based implementation did it.
+        """
+        count, total = self.counts[group], self.sums[group]
+        if count > 1:
+            return (count * self.squares[group] - total * total) / (4 * count * (count - 1))
+        return total / 2
+
+    def variances(self):
+        """
+        The sample variances of all the groups, computed in a single pass over the counts, sums
+        and sums of squares. These are exact integers in rating codes, so the usual cancellation
+        of the sum of squares formula can not happen and the result is correctly rounded.
+        """
+        return array.array('d', ((count * squares - total * total) / (4 * count * (count - 1)) if count > 1
+                                 else total / 2 for count, total, squares in zip(self.counts, self.sums, self.squares)))
+
+    def nth_code(self, group, position):
+        """
+        Returns the rating code standing at the position of the group's sorted ratings
+        """
+        offset = group * RATING_CODES
+        for code in range(1, RATING_CODES + 1):
+            position -= self.histograms[offset + code - 1]
+            if position < 0:
+                return code
+        raise IndexError(position)
+
+    def quantile(self, group, fraction):
+        """
+        The quantile of the group's ratings, interpolated linearly between the two closest ratings.
+        It is exact and costs O(1) per group, as it is read from the histogram.
+        """
+        position = fraction * (self.counts[group] - 1)
+        lower = int(position)
+        lower_code = self.nth_code(group, lower)
+        if position == lower:
+            return lower_code / 2
+        upper_code = self.nth_code(group, lower + 1)
+        return (lower_code + (upper_code - lower_code) * (position - lower)) / 2
+
+    def median(self, group):
+        return self.quantile(group, 0.5)
+
+    def metric(self, group, metric):
+        return get_metric_function(metric)(self, group)
+
+
+def get_metric_function(metric):
+    """
+    Returns the function(groups, group) computing the metric of a group: "average", "median"
+    or a percentile such as "p90" or "p99.9"
+    """
+    if metric == "average":
+        return RatingGroups.mean
+    if metric == "median":
+        return RatingGroups.median
+    match = re.fullmatch(r'p(\d+(?:\.\d+)?)', metric)
+    if match is None or float(match.group(1)) > 100:
+        raise ValueError(f"Unknown metric {metric}, use average, median or a percentile like p90")
+    fraction = float(match.group(1)) / 100
+    return lambda groups, group: groups.quantile(group, fraction)
+
+
+class RatingsSummary(object):
+    """
+    Per-movie and per-user rating groups and the counts of ratings by day, built together
+    in one scan of the rating columns. All of them are counters, so the summaries of separate
+    chunks of the file can be folded into one: add_columns can be called once per chunk,
+    then summarize finishes the groups and counts the years. The counts by calendar unit are
+    kept in buckets until new ratings come.
+    """
+
+    def __init__(self):
+        self.movies = RatingGroups()
+        self.users = RatingGroups()
+        self.days = collections.Counter()
+        self.buckets = {}
+
+    def add_columns(self, user_ids, movie_ids, rating_codes, timestamps):
+        movies, users = self.movies, self.users
+        movie_index, user_index = movies.index, users.index
+        movie_histograms, user_histograms = movies.histograms, users.histograms
+        for user_id, movie_id, code in zip(user_ids, movie_ids, rating_codes):
+            movie = movie_index.get(movie_id)
+            if movie is None:
+                movie = movies.group(movie_id)
+            user = user_index.get(user_id)
+            if user is None:
+                user = users.group(user_id)
+            movie_histograms[movie * RATING_CODES + code - 1] += 1
+            user_histograms[user * RATING_CODES + code - 1] += 1
+        self.days.update(timestamp // DAY_SECONDS for timestamp in timestamps)
+        self.buckets = {}
+
+    def merge(self, other):
+        self.movies.merge(other.movies)
+        self.users.merge(other.users)
+        self.days.update(other.days)
+        self.buckets = {}
+
+    def update_columns(self, user_ids, movie_ids, rating_codes, timestamps):
+        """
+        Adds new ratings to a summarized summary, the cost depends on the new ratings only
+        """
+        for user_id, movie_id, code in zip(user_ids, movie_ids, rating_codes):
+            self.movies.add(movie_id, code)
+            self.users.add(user_id, code)
+        self.days.update(timestamp // DAY_SECONDS for timestamp in timestamps)
+        self.buckets = {}
+
+    def summarize(self):
+        self.movies.summarize()
+        self.users.summarize()
+        self.time_counts("year")
+
+    def rating_counts(self):
+        """
+        Returns the number of ratings for every rating code, summed over all movies
+        """
+        counts = [0] * RATING_CODES
+        histograms = self.movies.histograms
+        for position in range(len(histograms)):
+            counts[position % RATING_CODES] += histograms[position]
+        return counts
+
+    def time_counts(self, unit):
+        """
+        Returns the number of ratings in every calendar year, month or day, sorted by time.
+        The days are sorted once per unit, every bucket is then one binary search and a difference
+        of the prefix sums of the day counts.
+        """
+        counts = self.buckets.get(unit)
+        if counts is None:
+            days = sorted(self.days)
+            prefix = [0]
+            prefix.extend(itertools.accumulate(map(self.days.__getitem__, days)))
+            counts, low = collections.OrderedDict(), 0
+            while low < len(days):
+                timestamp = days[low] * DAY_SECONDS
+                high = bisect.bisect_left(days, get_next_time_bucket(timestamp, unit) // DAY_SECONDS, low)
+                counts[get_time_bucket(timestamp, unit)] = prefix[high] - prefix[low]
+                low = high
+            self.buckets[unit] = counts
+        return collections.OrderedDict(counts)
+
+
+class TimeIndex(object):
+    """
+    The ratings ordered by timestamp: the sorted timestamps, the positions of the ratings in
+    the columns and their rating codes in the same order, and the counts of every rating code
+    before every block of TIME_BLOCK ratings. A time range is found by binary search, the rating
+    counts of a range take two prefix lookups plus a scan of at most two partial blocks, and
+    the calendar histograms take one binary search per non-empty bucket.
+    Ranges are given as unix timestamps, start included and end excluded, None for no bound.
+    """
+
+    def __init__(self, timestamps, rating_codes):
+        self.order = array.array('i', sorted(range(len(timestamps)), key=timestamps.__getitem__))
+        self.timestamps = array.array('q', (timestamps[position] for position in self.order))
+        self.rating_codes = array.array('B', (rating_codes[position] for position in self.order))
+        self.prefix = array.array('q', [0] * RATING_CODES)
+        self.extend_prefix()
+
+    def extend_prefix(self):
+        """
+        Adds the counts before the blocks which start after the last one counted
+        """
+        counts = list(self.prefix[-RATING_CODES:])
+        for start in range(len(self.prefix) // RATING_CODES * TIME_BLOCK, len(self.rating_codes) + 1, TIME_BLOCK):
+            for code in self.rating_codes[start - TIME_BLOCK:start]:
+                counts[code - 1] += 1
+            self.prefix.extend(counts)
+
+    def extend(self, timestamps, rating_codes, position):
+        """
+        Adds the ratings appended to the columns at the position, in O(delta) when none of them is
+        older than the indexed ones. Returns False without adding anything otherwise.
+        """
+        order = sorted(range(len(timestamps)), key=timestamps.__getitem__)
+        if order and self.timestamps and timestamps[order[0]] < self.timestamps[-1]:
+            return False
+        self.order.extend(position + index for index in order)
+        self.timestamps.extend(timestamps[index] for index in order)
+        self.rating_codes.extend(rating_codes[index] for index in order)
+        self.extend_prefix()
+        return True
+
+    def bounds(self, start=None, end=None):
+        low = 0 if start is None else bisect.bisect_left(self.timestamps, start)
+        high = len(self.timestamps) if end is None else bisect.bisect_left(self.timestamps, end)
+        return low, max(low, high)
+
+    def counts_before(self, position):
+        block = position // TIME_BLOCK
+        counts = list(self.prefix[block * RATING_CODES:(block + 1) * RATING_CODES])
+        for code in self.rating_codes[block * TIME_BLOCK:position]:
+            counts[code - 1] += 1
+        return counts
+
+    def rating_counts(self, start=None, end=None):
+        """
+        Returns the number of ratings for every rating code in the time range
+        """
+        low, high = self.bounds(start, end)
+        return [after - before for after, before in zip(self.counts_before(high), self.counts_before(low))]
+
+    def positions(self, start=None, end=None):
+        """
+        Returns the positions in the columns of the ratings in the time range, ordered by time
+        """
+        low, high = self.bounds(start, end)
+        return self.order[low:high]
+
+    def time_counts(self, unit, start=None, end=None):
+        """
+        Returns the number of ratings in every calendar year, month or day of the time range, sorted by time
+        """
+        low, high = self.bounds(start, end)
+        counts = collections.OrderedDict()
+        while low < high:
+            timestamp = self.timestamps[low]
+            bucket = get_time_bucket(timestamp, unit)
+            position = bisect.bisect_left(self.timestamps, get_next_time_bucket(timestamp, unit), low, high)
+            counts[bucket] = position - low
+            low = position
+        return counts
+
+
+SIMILARITY_METRICS = ("cosine", "pearson", "common")
+NEIGHBORS_K = 50
+NEIGHBORS_BLOCK = 256
+RATINGS_MATRIX = None
+
+
+def get_starts(counts):
+    """
+    Returns the offsets where the rows of the given lengths start, and the total length last
+    """
+    starts = array.array('q', [0])
+    starts.extend(itertools.accumulate(counts))
+    return starts
+
+
+class RatingsMatrix(object):
+    """
+    The ratings as a sparse user x movie matrix in the compressed sparse row form, kept twice:
+    the movies of every user and the users of every movie. Movies and users are numbered by their
+    groups in the ratings summary. A user who rated a movie more than once counts with the last rating.
+    The values depend on the metric: the rating codes for "cosine", the rating codes less the movie's
+    mean for "pearson" (the Pearson correlation with a missing rating taken as the mean), and ones for
+    "common", so that the dot product of two movies is the number of the users who rated both.
+    """
+
+    def __init__(self, summary, user_ids, movie_ids, rating_codes, metric="cosine"):
+        if metric not in SIMILARITY_METRICS:
+            raise ValueError(f"Unknown similarity metric {metric!r}, expected one of {SIMILARITY_METRICS}")
+        movies, users = summary.movies, summary.users
+        self.movie_keys = movies.keys
+        starts = get_starts(users.counts)
+        cursors = starts[:-1]
+        rated, codes = array.array('i', bytes(4 * len(rating_codes))), array.array('B', bytes(len(rating_codes)))
+        movie_index, user_index = movies.index, users.index
+        for position, (user_id, movie_id) in enumerate(zip(user_ids, movie_ids)):
+            user = user_index[user_id]
+            rated[cursors[user]], codes[cursors[user]] = movie_index[movie_id], rating_codes[position]
+            cursors[user] += 1
+        self.user_starts, self.user_movies, self.user_values = array.array('q', [0]), array.array('i'), array.array('f')
+        movie_counts, movie_sums = [0] * len(movies), [0] * len(movies)
+        for start, end in zip(starts, starts[1:]):
+            row = dict(zip(rated[start:end], codes[start:end]))
+            self.user_movies.extend(row.keys())
+            self.user_values.extend(row.values())
+            self.user_starts.append(len(self.user_movies))
+            for movie, code in row.items():
+                movie_counts[movie] += 1
+                movie_sums[movie] += code
+        if metric == "common":
+            self.user_values = array.array('f', [1.0]) * len(self.user_movies)
+        elif metric == "pearson":
+            means = [total / count if count else 0 for total, count in zip(movie_sums, movie_counts)]
+            self.user_values = array.array('f', (value - means[movie] for movie, value in zip(self.user_movies, self.user_values)))
+        self.movie_starts = get_starts(movie_counts)
+        cursors = self.movie_starts[:-1]
+        self.movie_users = array.array('i', bytes(4 * len(self.user_movies)))
+        self.movie_values = array.array('f', bytes(4 * len(self.user_movies)))
+        for user, (start, end) in enumerate(zip(self.user_starts, self.user_starts[1:])):
+            for movie, value in zip(self.user_movies[start:end], self.user_values[start:end]):
+                position = cursors[movie]
+                self.movie_users[position], self.movie_values[position] = user, value
+                cursors[movie] = position + 1
+        if metric == "common":
+            self.norms = array.array('d', [1.0]) * len(movies)
+        else:
+            self.norms = array.array('d', (math.sqrt(sum(value * value for value in self.movie_values[start:end]))
+                                           for start, end in zip(self.movie_starts, self.movie_starts[1:])))
+
+    def __len__(self):
+        return len(self.movie_keys)
+
+    def neighbors(self, movie, k):
+        """
+        Returns the k movies most similar to the movie as (movie, similarity) pairs, most similar first.
+        The dot products with all the other movies are accumulated over the movie's users, so only
+        the movies rated by at least one of them are touched. Similarities that are not positive are left out.
+        """
+        norm = self.norms[movie]
+        if not norm:
+            return []
+        movie_users, movie_values = self.movie_users, self.movie_values
+        user_starts, user_movies, user_values = self.user_starts, self.user_movies, self.user_values
+        scores = {}
+        get_score = scores.get
+        for position in range(self.movie_starts[movie], self.movie_starts[movie + 1]):
+            user, value = movie_users[position], movie_values[position]
+            start, end = user_starts[user], user_starts[user + 1]
+            for other, other_value in zip(user_movies[start:end], user_values[start:end]):
+                scores[other] = get_score(other, 0.0) + value * other_value
+        scores.pop(movie, None)
+        norms = self.norms
+        similarities = ((other, score / (norm * norms[other])) for other, score in scores.items()
+                        if score > 0 and norms[other])
+        return top_n(similarities, k, key=lambda x: x[1])
+
+
+def set_ratings_matrix(matrix):
+    global RATINGS_MATRIX
+    RATINGS_MATRIX = matrix
+
+
+def get_neighbors_range(first, last, k, matrix=None):
+    """
+    Finds the neighbors of the movies first..last-1 of the matrix, by default the one the worker process
+    was started with (see set_ratings_matrix). Returns the number of neighbors of every movie,
+    the neighbors' movieIds and their similarities.
+    """
+    matrix = RATINGS_MATRIX if matrix is None else matrix
+    counts, neighbors, similarities = array.array('i'), array.array('i'), array.array('f')
+    for movie in range(first, last):
+        ranked = matrix.neighbors(movie, k)
+        counts.append(len(ranked))
+        for other, similarity in ranked:
+            neighbors.append(matrix.movie_keys[other])
+            similarities.append(similarity)
+    return counts, neighbors, similarities
+
+
+class NeighborIndex(object):
+    """
+    The k nearest neighbors of every rated movie, packed like a sparse matrix: the neighbors of the movie
+    movie_ids[row] are neighbors[starts[row]:starts[row + 1]] with their similarities, most similar first.
+    A lookup is one dict access and two slices.
+
+    It is built in blocks of NEIGHBORS_BLOCK movies, so only one block of results per worker is held
+    besides the matrix. With workers > 1 the blocks are spread over a pool of worker processes,
+    each of them gets a copy of the matrix once.
+    """
+
+    def __init__(self, movie_ids, starts, neighbors, similarities, metric, k):
+        self.movie_ids = movie_ids
+        self.starts = starts
+        self.neighbors = neighbors
+        self.similarities = similarities
+        self.metric = metric
+        self.k = k
+        self.rows = {movie_id: row for row, movie_id in enumerate(movie_ids)}
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    @classmethod
+    def build(cls, matrix, metric, k, workers=None):
+        counts, neighbors, similarities = array.array('i'), array.array('i'), array.array('f')
+        block = NEIGHBORS_BLOCK
+        if workers and workers > 1:
+            block = max(1, min(block, -(-len(matrix) // (4 * workers))))
+        blocks = [(first, min(first + block, len(matrix))) for first in range(0, len(matrix), block)]
+        if workers and workers > 1:
+            import concurrent.futures
+            with concurrent.futures.ProcessPoolExecutor(workers, initializer=set_ratings_matrix,
+                                                        initargs=(matrix,)) as executor:
+                parts = [executor.submit(get_neighbors_range, first, last, k) for first, last in blocks]
+                for part in parts:
+                    for column, values in zip((counts, neighbors, similarities), part.result()):
+                        column.extend(values)
+        else:
+            for first, last in blocks:
+                for column, values in zip((counts, neighbors, similarities), get_neighbors_range(first, last, k, matrix)):
+                    column.extend(values)
+        return cls(matrix.movie_keys, get_starts(counts), neighbors, similarities, metric, k)
+
+    def get_neighbors(self, movie_id, k=None):
+        """
+        Returns the k (at most the index's k) most similar movies as (movieId, similarity) pairs
+        """
+        row = self.rows.get(movie_id)
+        if row is None:
+            return []
+        start = self.starts[row]
+        end = self.starts[row + 1] if k is None else min(self.starts[row + 1], start + k)
+        return list(zip(self.neighbors[start:end], self.similarities[start:end]))
+
+    def store(self, cache_dir, path, signature):
+        store_cache(cache_dir, path, f'neighbors-{self.metric}', signature, {
+            "movie_ids": self.movie_ids, "starts": self.starts,
+            "neighbors": self.neighbors, "similarities": self.similarities,
+        }, {"k": self.k})
+
+    @classmethod
+    def load(cls, cache_dir, path, metric, k):
+        """
+        Returns the cached index of the ratings file, None if there is no fresh one with at least k neighbors
+        """
+        cache = load_cache(cache_dir, path, f'neighbors-{metric}')
+        if cache is None:
+            return None
+        columns, meta = cache
+        if meta.get("k", 0) < k:
+            return None
+        return cls(columns["movie_ids"], columns["starts"], columns["neighbors"], columns["similarities"],
+                   metric, meta["k"])
+
+
+class RatingsRows(collections.abc.Sequence):
+    """
+    Read-only legacy view of the rating columns as [userId, movieId, rating, timestamp] rows of strings
+    """
+
+    def __init__(self, ratings):
+        self.ratings = ratings
+
+    def __len__(self):
+        return len(self.ratings.user_ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return [str(self.ratings.user_ids[index]),
+                str(self.ratings.movie_ids[index]),
+                decode_rating(self.ratings.rating_codes[index]),
+                str(self.ratings.timestamps[index])]
 
 
 class Ratings(object):
     """
     Analyzing data from ratings.csv
+
+    The file is parsed once into typed columns: user_ids and movie_ids (int32), rating_codes
+    (uint8 half-star codes, see encode_rating) and timestamps (int64).
+
+    The file is read in binary blocks of about chunk_size bytes, each block is converted into
+    the columns in bulk, see parse_ratings_text. The malformed rows are skipped and counted
+    in malformed.
+
+    With stream=True every block is folded into the summary and dropped, so memory does not
+    grow with the file. The columns stay
+    empty in this mode, but all the methods of Ratings.Movies and Ratings.Users work and
+    give the same results.
+
+    With workers > 1 the file is split into byte ranges which are parsed and summarized
+    by a pool of worker processes, then the parts are merged in file order. The result is
+    the same as the one of the serial reading, and the summary is ready right away.
+
+    With a cache_dir (or the MOVIELENS_CACHE_DIR environment variable) the parsed columns and
+    the summary are written to a binary cache the first time the file is read. Later the cache
+    is memory-mapped instead of parsing the file, then the columns are read-only memoryviews.
+    The cache is rebuilt when the file's size or modification time changes.
+
+    New ratings are added with append, or read from the end of a growing file with tail.
+    The summary is updated with the new ratings only, there is no rescan. The results of
+    Ratings.Movies and Ratings.Users are memoized (see memoized) until ratings are added.
+
+    The distributions of Ratings.Movies can be restricted to a time range. The ratings are
+    sorted by timestamp once, on the first such query, see TimeIndex. The stream mode keeps
+    no timestamps, so only the whole time range can be asked for there.
+
+    The similar movies of Ratings.Movies come from a NeighborIndex built once per metric from
+    the ratings matrix, see RatingsMatrix. With a cache_dir the index is cached next to the
+    parsed columns, so later processes only map it.
     """
 
-    def __init__(self, spath):
-        def get_generator_list_lines(file_name):
-            with open(file_name, 'r') as f:
-                f.readline()
-                for line in f:
-                    yield line
-                    
+    @instrumented
+    def __init__(self, spath, stream=False, chunk_size=CHUNK_SIZE, workers=None, cache_dir=None):
+        self.stream = stream
+        self.user_ids = array.array('i')
+        self.movie_ids = array.array('i')
+        self.rating_codes = array.array('B')
+        self.timestamps = array.array('q')
+        self.summary = RatingsSummary() if stream else None
+        self.time_index = None
+        self.neighbor_indexes = {}
+        self.version = 0
+        self.path = spath
+        self.offset = 0
+        self.malformed = MalformedRows()
+        self.workers = workers
+        self.cache_dir = cache_dir = None if stream else get_cache_dir(cache_dir)
         try:
-            self.data = []
-            for line in get_generator_list_lines(spath):
-                self.data.append([x for x in line.split(',')])
+            signature = get_file_signature(spath)
+            self.offset = signature["size"]
+            cached = cache_dir is not None and self.read_cache(spath, cache_dir)
+            if not cached:
+                if workers and workers > 1:
+                    self.read_parallel(spath, chunk_size, workers)
+                else:
+                    self.read(spath, chunk_size)
         except IOError:
             print(f"There is no file {spath}")
-        except Exception:
-            print(sys.info())
+            return
+        count_rows(0 if cached else self.rows)
+        if not cached:
+            if self.summary is not None:
+                self.summary.summarize()
+            if cache_dir is not None:
+                self.write_cache(spath, cache_dir, signature)
+            self.malformed.report(spath)
+
+    @property
+    def data(self):
+        """
+        Legacy row view for old callers, the rows are built on access
+        """
+        if self.stream:
+            raise ValueError("Ratings in the stream mode keep no rows")
+        return RatingsRows(self)
+
+    @property
+    def rows(self):
+        if self.stream:
+            return sum(self.summary.movies.counts)
+        return len(self.user_ids)
+
+    def columns(self):
+        return self.user_ids, self.movie_ids, self.rating_codes, self.timestamps
+
+    def read(self, spath, chunk_size):
+        for start, end in get_byte_ranges(spath, 1, self.offset):
+            for block in get_generator_blocks(spath, start, end, chunk_size):
+                columns = parse_ratings_text(block, self.malformed)
+                if self.stream:
+                    self.summary.add_columns(*columns)
+                else:
+                    for column, values in zip(self.columns(), columns):
+                        column.extend(values)
+
+    def append(self, rows):
+        """
+        Adds rows of (userId, movieId, rating, timestamp) to the ratings. Raises ValueError, adding
+        none of the rows, if a rating is not a half star, see encode_rating.
+        """
+        columns = (array.array('i'), array.array('i'), array.array('B'), array.array('q'))
+        for user_id, movie_id, rating, timestamp in rows:
+            columns[0].append(int(user_id))
+            columns[1].append(int(movie_id))
+            columns[2].append(encode_rating(rating))
+            columns[3].append(int(timestamp))
+        self.append_columns(columns)
+
+    def append_columns(self, columns):
+        """
+        Adds the columns of new ratings. The time index takes the ratings not older than the indexed ones
+        in place and is dropped for the others. Nothing changes, the memo included, if there are no ratings.
+        """
+        if not len(columns[0]):
+            return
+        self.neighbor_indexes = {}
+        self.version += 1
+        if not self.stream:
+            position = len(self.timestamps)
+            self.user_ids, self.movie_ids, self.rating_codes, self.timestamps = map(get_writable, self.columns())
+            for column, values in zip(self.columns(), columns):
+                column.extend(values)
+            if self.time_index is not None and not self.time_index.extend(columns[3], columns[2], position):
+                self.time_index = None
+        if self.summary is not None:
+            self.summary.update_columns(*columns)
+
+    @instrumented
+    def tail(self, path=None, offset=None):
+        """
+        Appends the ratings written to the file after the byte offset, by default the ones written since
+        the file was read or tailed last time. Returns the offset to continue from.
+        The writers are expected to append whole lines.
+        """
+        path = self.path if path is None else path
+        offset = self.offset if offset is None else offset
+        lines = []
+        for line, offset in get_generator_tail_lines(path, offset):
+            lines.append(line)
+        count_rows(len(lines))
+        self.append_columns(parse_ratings_text(''.join(lines), self.malformed))
+        if path == self.path:
+            self.offset = offset
+        return offset
+
+    def read_cache(self, spath, cache_dir):
+        cache = load_cache(cache_dir, spath, 'ratings')
+        if cache is None:
+            return False
+        columns, meta = cache
+        if "days" not in meta:
+            return False
+        self.user_ids, self.movie_ids = columns["user_ids"], columns["movie_ids"]
+        self.rating_codes, self.timestamps = columns["rating_codes"], columns["timestamps"]
+        summary = RatingsSummary()
+        summary.movies = RatingGroups.from_columns(columns["movie_keys"], columns["movie_histograms"])
+        summary.users = RatingGroups.from_columns(columns["user_keys"], columns["user_histograms"])
+        summary.days.update(dict(meta["days"]))
+        self.summary = summary
+        return True
+
+    def write_cache(self, spath, cache_dir, signature):
+        summary = self.get_summary()
+        store_cache(cache_dir, spath, 'ratings', signature, {
+            "user_ids": self.user_ids, "movie_ids": self.movie_ids,
+            "rating_codes": self.rating_codes, "timestamps": self.timestamps,
+            "movie_keys": summary.movies.keys, "movie_histograms": summary.movies.histograms,
+            "user_keys": summary.users.keys, "user_histograms": summary.users.histograms,
+        }, {"days": list(summary.days.items())})
+
+    def read_parallel(self, spath, chunk_size, workers):
+        self.summary = RatingsSummary()
+        ranges = get_byte_ranges(spath, workers, self.offset)
+        import concurrent.futures
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            parts = [executor.submit(parse_ratings_range, spath, start, end, not self.stream, chunk_size)
+                     for start, end in ranges]
+            for part in parts:
+                columns, summary, malformed = part.result()
+                self.summary.merge(summary)
+                self.malformed.merge(malformed)
+                if columns is not None:
+                    for column, values in zip(self.columns(), columns):
+                        column.extend(values)
+
+    @instrumented
+    def get_summary(self):
+        """
+        Returns the per-movie and per-user statistics. They are computed in one scan
+        on the first call and shared by all the methods of Ratings.Movies and Ratings.Users.
+        """
+        count_rows(0 if self.summary is not None else len(self.user_ids))
+        if self.summary is None:
+            summary = RatingsSummary()
+            summary.add_columns(*self.columns())
+            summary.summarize()
+            self.summary = summary
+        return self.summary
+
+    @instrumented
+    def get_time_index(self):
+        """
+        Returns the ratings sorted by timestamp, sorted on the first call
+        """
+        if self.stream:
+            raise ValueError("Ratings in the stream mode keep no timestamps to query by time")
+        count_rows(0 if self.time_index is not None else len(self.timestamps))
+        if self.time_index is None:
+            self.time_index = TimeIndex(self.timestamps, self.rating_codes)
+        return self.time_index
+
+    @instrumented
+    def get_neighbor_index(self, metric="cosine", k=None):
+        """
+        Returns the NeighborIndex of the movies by the metric with at least k neighbors per movie,
+        built on the first call. Without k the index built before is returned whatever its k,
+        else one with NEIGHBORS_K neighbors is built. The index of the file as it was read is cached
+        if there is a cache_dir.
+        """
+        if self.stream:
+            raise ValueError("Ratings in the stream mode keep no rows to compare the movies by")
+        index = self.neighbor_indexes.get(metric)
+        count_rows(0)
+        if index is None or k is not None and index.k < k:
+            k = NEIGHBORS_K if k is None else k
+            cacheable = self.cache_dir is not None and self.version == 0
+            index = NeighborIndex.load(self.cache_dir, self.path, metric, k) if cacheable else None
+            if index is None:
+                count_rows(len(self.user_ids))
+                matrix = RatingsMatrix(self.get_summary(), self.user_ids, self.movie_ids, self.rating_codes, metric)
+                index = NeighborIndex.build(matrix, metric, k, self.workers)
+                if cacheable:
+                    index.store(self.cache_dir, self.path, get_file_signature(self.path))
+            self.neighbor_indexes[metric] = index
+        return index
 
     class Movies(object):
+        """
+        The movie statistics of the ratings. The titles come from the MovieIndex of movies.csv shared
+        with Movies, the rankings are computed on the rating groups of the movies known to it and
+        the titles are looked up for the results only.
+        """
+
         def __init__(self, path, ratings):
-            
-            def get_generator_list_lines(file_name):
-                with open(file_name, 'r') as f:
-                    f.readline()
-                    for line in f:
-                        yield line
-                        
             self.ratings = ratings
-            try:
-                self.movies = {}
-                for line in get_generator_list_lines(path):
-                    self.movies[line[:line.index(',')]] = line[line.index(',') + 1:line.rindex(',')]
-            except IOError:
-                print(f"There is no file {path}")
-            except Exception:
-                print(sys.int_info)
-
-        def dist_by_year(self):
+            self.index = get_movie_index(path)
+
+        @property
+        def version(self):
+            return self.ratings.version
+
+        @property
+        def rows(self):
+            return self.ratings.rows
+
+        def get_known_groups(self, groups):
+            """
+            Returns the groups of the movies that are in movies.csv, in order of the groups
+            """
+            return [group for group, dense_id in enumerate(self.index.get_dense_ids(groups.keys)) if dense_id >= 0]
+
+        def get_titled(self, groups, ranked):
+            return collections.OrderedDict((self.index.get_title(groups.keys[group]), value) for group, value in ranked)
+
+        def time_counts(self, unit, start, end):
+            if start is None and end is None:
+                counts = self.ratings.get_summary().time_counts(unit)
+                count_rows(len(counts))
+                return counts
+            index = self.ratings.get_time_index()
+            low, high = index.bounds(start, end)
+            count_rows(high - low)
+            return index.time_counts(unit, start, end)
+
+        @memoized
+        def dist_by_year(self, start=None, end=None):
             """
             This method returns a dict where the keys are years and the values are counts.
             Sorted by years ascendigly.
+            Only the ratings from the start timestamp up to the end one (excluded) are counted if given.
+            """
+            return self.time_counts("year", start, end)
+
+        @memoized
+        def dist_by_month(self, start=None, end=None):
             """
-            ratings_by_year = collections.Counter([int(record[3]) // 31536000 + 1970 for record in self.ratings.data])
-            return collections.OrderedDict(ratings_by_year.most_common())
+            This method returns a dict where the keys are months like "2015-03" and the values are counts.
+            Sorted by months ascendigly.
+            """
+            return self.time_counts("month", start, end)
+
+        @memoized
+        def dist_by_day(self, start=None, end=None):
+            """
+            This method returns a dict where the keys are days like "2015-03-31" and the values are counts.
+            Sorted by days ascendigly.
+            """
+            return self.time_counts("day", start, end)
 
-        def dist_by_rating(self):
+        @memoized
+        def dist_by_rating(self, start=None, end=None):
             """
             The method returns a dict where the keys are ratings and the values are counts.
             Sorted by ratings ascendingly.
+            Only the ratings from the start timestamp up to the end one (excluded) are counted if given.
             """
-            ratings_distribution = collections.Counter([record[2] for record in self.ratings.data]).most_common()
-            return collections.OrderedDict(sorted(list(ratings_distribution), key=lambda x: x[0]))
+            if start is None and end is None:
+                ratings_distribution = self.ratings.get_summary().rating_counts()
+                count_rows(len(ratings_distribution))
+            else:
+                index = self.ratings.get_time_index()
+                low, high = index.bounds(start, end)
+                count_rows(high - low)
+                ratings_distribution = index.rating_counts(start, end)
+            return get_rating_distribution(ratings_distribution)
 
-        def top_by_num_of_ratings(self, n):
+        @memoized(top=True)
+        def top_by_num_of_ratings(self, n, start=None, end=None):
             """
             The method returns top n movies by the number of ratings.
             It is a dict where the keys are movie titles and the values are numbers.
             Sorted by numbers descendingly.
+            Only the ratings from the start timestamp up to the end one (excluded) are counted if given.
             """
-            top_movies = collections.Counter([record[1] for record in self.ratings.data]).most_common(n)
-            ordered_top_movies = []
-            for x in top_movies:
-                try:
-                    ordered_top_movies.append((self.movies[x[0]], x[1]))
-                except KeyError:
-                    continue
-            #top_movies = collections.OrderedDict(map(lambda x: (self.movies[x[0]], x[1]), top_movies))
-            return collections.OrderedDict(ordered_top_movies)
+            groups = self.ratings.get_summary().movies
+            count_rows(len(groups))
+            if start is None and end is None:
+                counts = groups.counts
+            else:
+                counts = [0] * len(groups)
+                movie_ids = self.ratings.movie_ids
+                positions = self.ratings.get_time_index().positions(start, end)
+                count_rows(len(positions))
+                for position in positions:
+                    counts[groups.index[movie_ids[position]]] += 1
+            movie_counts = ((group, counts[group]) for group in self.get_known_groups(groups) if counts[group])
+            return self.get_titled(groups, top_n(movie_counts, n, key=lambda x: x[1]))
 
+        @memoized(top=True)
         def top_by_ratings(self, n, metric="average"):
             """
             The method returns top n movies by the average or median of the ratings.
+            The metric can also be a percentile like "p90" or "p99".
             It is a dict where the keys are movie titles and the values are metric values.
             Sorted by metric descendingly.
             """
-            dist_movies = {}
-            for x in self.ratings.data:
-                try:
-                    dist_movies[self.movies[x[1]]] = dist_movies.setdefault(self.movies[x[1]], []) + [float(x[2])]
-                except KeyError:
-                    continue
-
-            if metric == "average":
-                average_ratings = sorted(map(lambda x: (x[0], sum(x[1]) / len(x[1])), dist_movies.items()),
-                                         key=lambda y: -y[1])[:n]
-                return collections.OrderedDict(average_ratings)
-            else:
+            groups = self.ratings.get_summary().movies
+            count_rows(len(groups))
+            get_metric = get_metric_function(metric)
+            movie_ratings = ((group, get_metric(groups, group)) for group in self.get_known_groups(groups))
+            return self.get_titled(groups, top_n(movie_ratings, n, key=lambda x: x[1]))
 
-                def get_median(x: list):
-                    if len(x) % 2:
-                        return x[len(x) // 2]
-                    else:
-                        return (x[len(x) // 2] + x[(len(x) + 1) // 2]) / 2
-
-                median_ratings = sorted(list(map(lambda x: (x[0], get_median(x[1])), dict(
-                    map(lambda x: (x[0], list(sorted(x[1]))), dist_movies.items())).items())), key=lambda x: -x[1])[:n]
-                return collections.OrderedDict(median_ratings)
-
-        def top_controversial(self, n):
+        @memoized(top=True)
+        def top_controversial(self, n, min_count=1):
             """
             The method returns top n movies by the variance of the ratings.
+            Only the movies with at least min_count ratings are taken into account.
             It is a dict where the keys are movie titles and the values are variances.
             Sorted by variances descendingly.
             """
+            groups = self.ratings.get_summary().movies
+            count_rows(len(groups))
+            variances, counts = groups.variances(), groups.counts
+            movie_variances = ((group, variances[group]) for group in self.get_known_groups(groups)
+                               if counts[group] >= min_count)
+            return self.get_titled(groups, top_n(movie_variances, n, key=lambda x: x[1]))
+
+        @memoized
+        def similar_movies(self, movie_id, k=10, metric="cosine"):
+            """
+            The method returns the k movies most similar to the movie by the ratings of the users who
+            rated both. The metric is "cosine", "pearson" or "common" for the number of such users
+            (the users who rated the movie also rated).
+            It is a dict where the keys are movie titles and the values are similarities.
+            Sorted by similarities descendingly. The movies that are not in movies.csv are left out.
+            k is capped at the k of the neighbor index, NEIGHBORS_K unless get_neighbor_index was
+            called with another one, so a query never rebuilds the index.
+            """
+            neighbors = self.ratings.get_neighbor_index(metric).get_neighbors(movie_id)
+            count_rows(len(neighbors))
+            known = ((other, similarity) for other, similarity in neighbors if self.index.get_dense_id(other) >= 0)
+            return collections.OrderedDict((self.index.get_title(other), similarity)
+                                           for other, similarity in itertools.islice(known, k))
+
+    class Users(object):
+        def __init__(self, ratings):
+            self.ratings = ratings
+
+        @property
+        def version(self):
+            return self.ratings.version
+
+        @property
+        def rows(self):
+            return self.ratings.rows
+
+        @memoized
+        def top_valuers(self):
+            """
+            The method returns the distribution of users by the number of ratings made by them.
+            It is a dict where the keys are users and the values are number of ratings
+            Sorted by descending order
+            """
+            groups = self.ratings.get_summary().users
+            count_rows(len(groups))
+            valuers = top_n(range(len(groups)), None, key=groups.counts.__getitem__)
+            return collections.OrderedDict((str(groups.keys[group]), groups.counts[group]) for group in valuers)
+
+        @memoized
+        def valuers_with_ratings(self, metric="average"):
+            """
+            The method returns the distribution of users by average or median ratings made by them.
+            The metric can also be a percentile like "p90" or "p99".
+            It is a dict where the keys are users and the values are metric values.
+            Sorted by descending order
+            """
+            groups = self.ratings.get_summary().users
+            count_rows(len(groups))
+            get_metric = get_metric_function(metric)
+            valuers = ((str(groups.keys[group]), get_metric(groups, group)) for group in range(len(groups)))
+            return collections.OrderedDict(top_n(valuers, None, key=lambda x: x[1]))
+
+        @memoized(top=True)
+        def top_controversial_valuers(self, n, min_count=1):
+            """
+            The method returns top n users with the biggest variance of their ratings.
+            Only the users with at least min_count ratings are taken into account.
+            It is a dict where the keys are users and the values are variances
+            Sorted by descending order
+            """
+            groups = self.ratings.get_summary().users
+            count_rows(len(groups))
+            variances, counts = groups.variances(), groups.counts
+            valuers_variances = ((str(groups.keys[group]), variances[group]) for group in range(len(groups))
+                                 if counts[group] >= min_count)
+            return collections.OrderedDict(top_n(valuers_variances, n, key=lambda x: x[1]))
+
+
+class TagVocabulary(object):
+    """
+    The distinct tags of tags.csv. The id of a tag is its position in order of first appearance.
+    The length in characters, the number of words and the number of rows of every tag
+    are computed once, when the tag is added.
+    """
+
+    def __init__(self):
+        self.index = {}
+        self.tags = []
+        self.lengths = array.array('i')
+        self.words = array.array('i')
+        self.counts = array.array('q')
+
+    def __len__(self):
+        return len(self.tags)
+
+    def add(self, tag, count=1):
+        """
+        Counts count more rows of the tag and returns its id
+        """
+        tag_id = self.index.get(tag)
+        if tag_id is None:
+            tag_id = self.index[tag] = len(self.tags)
+            self.tags.append(tag)
+            self.lengths.append(len(tag))
+            self.words.append(len(tag.split(' ')))
+            self.counts.append(0)
+        self.counts[tag_id] += count
+        return tag_id
+
+    def merge(self, other):
+        """
+        Adds the tags of other and returns the array mapping other's ids to the ids in this vocabulary
+        """
+        return array.array('i', (self.add(tag, count) for tag, count in zip(other.tags, other.counts)))
+
+
+def parse_tags_text(text, vocabulary, malformed=None):
+    """
+    Parses csv text of tags.csv into the columns user_ids, movie_ids, tag_ids and timestamps,
+    interning the tags into the vocabulary. Text without quotes where every line has four fields
+    is converted in bulk, otherwise the rows are parsed with the RFC 4180 quoting. A tag with
+    unquoted commas is still taken whole, as everything between the second and the last field.
+    The malformed rows are skipped and counted in malformed.
+    """
+    malformed = MalformedRows() if malformed is None else malformed
+    text = text.rstrip('\n')
+    lines = text.split('\n')
+    if text and '"' not in text and set(map(str.count, lines, itertools.repeat(','))) == {3}:
+        fields = ','.join(lines).split(',')
+        try:
+            user_ids, movie_ids = array.array('i', map(int, fields[0::4])), array.array('i', map(int, fields[1::4]))
+            timestamps = array.array('q', map(int, fields[3::4]))
+        except (ValueError, OverflowError):
+            pass
+        else:
+            return user_ids, movie_ids, array.array('i', map(vocabulary.add, fields[2::4])), timestamps
+    user_ids, movie_ids = array.array('i'), array.array('i')
+    tag_ids, timestamps = array.array('i'), array.array('q')
+    for row in get_csv_rows(text, 4, malformed):
+        try:
+            values = int(row[0]), int(row[1]), int(row[-1])
+        except (ValueError, OverflowError):
+            malformed.add("value", row)
+            continue
+        if append_row((user_ids, movie_ids, timestamps), values, malformed, row):
+            tag_ids.append(vocabulary.add(','.join(row[2:-1])))
+    return user_ids, movie_ids, tag_ids, timestamps
+
+
+def parse_tags_range(file_name, start, end):
+    """
+    Parses one byte range of tags.csv with its own vocabulary, this runs in the worker processes
+    """
+    vocabulary, malformed = TagVocabulary(), MalformedRows()
+    columns = (array.array('i'), array.array('i'), array.array('i'), array.array('q'))
+    for block in get_generator_blocks(file_name, start, end):
+        for column, values in zip(columns, parse_tags_text(block, vocabulary, malformed)):
+            column.extend(values)
+    return columns, vocabulary, malformed
+
+
+class TagsRows(collections.abc.Sequence):
+    """
+    Read-only legacy view of the tag columns as [userId, movieId, tag, timestamp] rows of strings
+    """
 
-            def get_variance(ratings: list):
-                mean = sum(ratings) / len(ratings)
-                if len(ratings) > 1:
-                    return sum(map(lambda x: (x - mean) * (x - mean), ratings)) / (len(ratings) - 1)
-                else:
-                    return ratings[0]
+    def __init__(self, tags):
+        self.tags = tags
 
-            dist_movies = {}
-            for x in self.ratings.data:
-                try:
-                    dist_movies[self.movies[x[1]]] = dist_movies.setdefault(self.movies[x[1]], []) + [float(x[2])]
-                except KeyError:
-                    continue
-            movie_variances = sorted(map(lambda x: (x[0], get_variance(x[1])), dist_movies.items()),
-                                         key=lambda y: -y[1])[:n]
-            return collections.OrderedDict(movie_variances)
+    def __len__(self):
+        return len(self.tags.tag_ids)
 
-    class Users(object):
-        def __init__(self, ratings):
-            self.ratings = ratings
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return [str(self.tags.user_ids[index]),
+                str(self.tags.movie_ids[index]),
+                self.tags.vocabulary.tags[self.tags.tag_ids[index]],
+                str(self.tags.timestamps[index])]
 
-        def top_valuers(self):
-            """
-            The method returns the distribution of users by the number of ratings made by them.
-            It is a dict where the keys are users and the values are number of ratings
-            Sorted by descending order
-            """
-            valuers = collections.Counter(map(lambda x: x[0], self.ratings.data)).most_common()
-            return collections.OrderedDict(valuers)
 
-        def valuers_with_ratings(self, metric="average"):
-            """
-            The method returns the distribution of users by average or median ratings made by them.
-            It is a dict where the keys are users and the values are metric values.
-            Sorted by descending order
-            """
-            dist_valuers = {}
-            for x in self.ratings.data:
-                dist_valuers[x[0]] = dist_valuers.setdefault(x[0], []) + [float(x[2])]
+class TagIndex(object):
+    """
+    Trigram index over distinct tags for substring search.
 
-            if metric == "average":
-                average_ratings = sorted(map(lambda x: (x[0], sum(x[1]) / len(x[1])), dist_valuers.items()), key=lambda y: -y[1])
-                return collections.OrderedDict(average_ratings)
-            else:
+    Every trigram of a tag points to the ids of the tags which contain it, so a query only checks
+    the tags containing all the trigrams of the word. The searches with ignore_case use a second
+    index over the casefolded lowercased tags, built on their first call: lowercasing does not keep
+    every substring a substring (a final sigma, a dotted capital I), casefolding the lowercased forms
+    does, so neither index drops a match. Words shorter than three characters have no trigrams
+    and are checked against all the distinct tags.
+    """
 
-                def get_median(x: list):
-                    if len(x) % 2:
-                        return x[len(x) // 2]
-                    else:
-                        return (x[len(x) // 2] + x[(len(x) + 1) // 2]) / 2
+    def __init__(self, tags):
+        self.tags = []
+        self.lowered = []
+        self.postings = {}
+        self.folded_postings = None
+        for tag in tags:
+            self.add(tag)
 
-                median_ratings = sorted(list(map(lambda x: (x[0], get_median(x[1])), dict(map(lambda x: (x[0], list(sorted(x[1]))), dist_valuers.items())).items())), key=lambda x: -x[1])
-                return collections.OrderedDict(median_ratings)
+    def add(self, tag):
+        """
+        Adds a new tag, its id is the next one
+        """
+        tag_id = len(self.tags)
+        self.tags.append(tag)
+        self.lowered.append(tag.lower())
+        self.post(self.postings, tag, tag_id)
+        if self.folded_postings is not None:
+            self.post(self.folded_postings, self.lowered[-1].casefold(), tag_id)
 
-        def top_controversial_valuers(self, n):
-            """
-            The method returns top n users with the biggest variance of their ratings.
-            It is a dict where the keys are users and the values are variances
-            Sorted by descending order
-            """
+    @staticmethod
+    def post(postings, text, tag_id):
+        for trigram in {text[i:i + 3] for i in range(len(text) - 2)}:
+            posting = postings.get(trigram)
+            if posting is None:
+                posting = postings[trigram] = array.array('i')
+            posting.append(tag_id)
 
-            def get_variance(ratings: list):
-                mean = sum(ratings) / len(ratings)
-                if len(ratings) > 1:
-                    return sum(map(lambda x: (x - mean) * (x - mean), ratings)) / (len(ratings) - 1)
-                else:
-                    return ratings[0]
+    def get_folded_postings(self):
+        if self.folded_postings is None:
+            folded_postings = {}
+            for tag_id, lowered in enumerate(self.lowered):
+                self.post(folded_postings, lowered.casefold(), tag_id)
+            self.folded_postings = folded_postings
+        return self.folded_postings
+
+    def candidates(self, word, ignore_case=False):
+        """
+        Returns the ids of the tags which have all the trigrams of the word, of the casefolded
+        lowercased tags and word with ignore_case
+        """
+        if ignore_case:
+            word, postings = word.lower().casefold(), self.get_folded_postings()
+        else:
+            postings = self.postings
+        trigrams = {word[i:i + 3] for i in range(len(word) - 2)}
+        if not trigrams:
+            return range(len(self.tags))
+        postings = sorted((postings.get(trigram, ()) for trigram in trigrams), key=len)
+        found = set(postings[0])
+        for posting in postings[1:]:
+            if not found:
+                break
+            found.intersection_update(posting)
+        return found
 
-            dist_movies = {}
-            for x in self.ratings.data:
-                dist_movies[x[0]] = dist_movies.setdefault(x[0], []) + [float(x[2])]
-            movie_variances = sorted(map(lambda x: (x[0], get_variance(x[1])), dist_movies.items()),
-                                     key=lambda y: -y[1])[:n]
-            return collections.OrderedDict(movie_variances)
+    def search(self, word, ignore_case=False, whole_word=False):
+        """
+        Returns the sorted tags which include the word
+        """
+        candidates = self.candidates(word, ignore_case)
+        count_rows(len(candidates))
+        tags = self.lowered if ignore_case else self.tags
+        if ignore_case:
+            word = word.lower()
+        if whole_word:
+            matches = re.compile(r'(?<!\w)' + re.escape(word) + r'(?!\w)').search
+        else:
+            matches = lambda tag: word in tag
+        return sorted(self.tags[tag_id] for tag_id in candidates if matches(tags[tag_id]))
 
 
 class Tags(object):
     """
     Analyzing data from tags.csv
+
+    The tags are interned into a TagVocabulary and the rows are kept as the integer columns
+    user_ids, movie_ids, tag_ids and timestamps, so the methods work on the distinct tags only.
+    The file is read and parsed in blocks as in Ratings, the malformed rows are counted in malformed.
+    With workers > 1 the byte ranges of the file are parsed by a pool of worker processes.
+    With a cache_dir the columns and the vocabulary are kept in a binary cache, as in Ratings.
+    The index of tags_with is built on its first call and reused.
+    New tags are added with append or tail, as in Ratings. The results are memoized until then.
     """
-    def __init__(self, path):
+    @instrumented
+    def __init__(self, path, workers=None, cache_dir=None):
+        cache_dir = get_cache_dir(cache_dir)
+        self.vocabulary = TagVocabulary()
+        self.user_ids = array.array('i')
+        self.movie_ids = array.array('i')
+        self.tag_ids = array.array('i')
+        self.timestamps = array.array('q')
+        self.index = None
+        self.version = 0
+        self.path = path
+        self.offset = 0
+        self.malformed = MalformedRows()
         try:
-            self.data = []
-            with open(path, "r") as tags_file:
-                tags_file.readline()
-                for line in tags_file:
-                    self.data.append([x for x in line.split(',')])
+            signature = get_file_signature(path)
+            self.offset = signature["size"]
+            cached = cache_dir is not None and self.read_cache(path, cache_dir)
+            if not cached:
+                if workers and workers > 1:
+                    self.read_parallel(path, workers)
+                else:
+                    for start, end in get_byte_ranges(path, 1, self.offset):
+                        for block in get_generator_blocks(path, start, end):
+                            self.append_columns(parse_tags_text(block, self.vocabulary, self.malformed))
         except IOError:
             print(f"There is no file {path}")
-        except Exception:
-            print(sys.info())
+            return
+        count_rows(0 if cached else len(self.tag_ids))
+        if not cached:
+            if cache_dir is not None:
+                self.write_cache(path, cache_dir, signature)
+            self.malformed.report(path)
+
+    @property
+    def data(self):
+        """
+        Legacy row view for old callers, the rows are built on access
+        """
+        return TagsRows(self)
+
+    @property
+    def rows(self):
+        return len(self.tag_ids)
+
+    def columns(self):
+        return self.user_ids, self.movie_ids, self.tag_ids, self.timestamps
+
+    def append(self, rows):
+        """
+        Adds rows of (userId, movieId, tag, timestamp) to the tags
+        """
+        columns = (array.array('i'), array.array('i'), array.array('i'), array.array('q'))
+        for user_id, movie_id, tag, timestamp in rows:
+            columns[0].append(int(user_id))
+            columns[1].append(int(movie_id))
+            columns[2].append(self.vocabulary.add(tag))
+            columns[3].append(int(timestamp))
+        self.append_columns(columns)
+
+    def append_columns(self, columns):
+        """
+        Adds columns whose tags are already in the vocabulary, the index learns the new tags.
+        Nothing changes, the memo included, if there are no tags.
+        """
+        if not len(columns[0]):
+            return
+        self.version += 1
+        self.user_ids, self.movie_ids, self.tag_ids, self.timestamps = map(get_writable, self.columns())
+        for column, values in zip(self.columns(), columns):
+            column.extend(values)
+        if self.index is not None:
+            for tag in self.vocabulary.tags[len(self.index.tags):]:
+                self.index.add(tag)
 
+    @instrumented
+    def tail(self, path=None, offset=None):
+        """
+        Appends the tags written to the file after the byte offset, by default the ones written since
+        the file was read or tailed last time. Returns the offset to continue from.
+        The writers are expected to append whole lines.
+        """
+        path = self.path if path is None else path
+        offset = self.offset if offset is None else offset
+        lines = []
+        for line, offset in get_generator_tail_lines(path, offset):
+            lines.append(line)
+        count_rows(len(lines))
+        self.append_columns(parse_tags_text(''.join(lines), self.vocabulary, self.malformed))
+        if path == self.path:
+            self.offset = offset
+        return offset
+
+    def read_parallel(self, path, workers):
+        ranges = get_byte_ranges(path, workers, self.offset)
+        import concurrent.futures
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            parts = [executor.submit(parse_tags_range, path, start, end) for start, end in ranges]
+            for part in parts:
+                (user_ids, movie_ids, tag_ids, timestamps), vocabulary, malformed = part.result()
+                tag_map = self.vocabulary.merge(vocabulary)
+                self.malformed.merge(malformed)
+                self.user_ids.extend(user_ids)
+                self.movie_ids.extend(movie_ids)
+                self.tag_ids.extend(tag_map[tag_id] for tag_id in tag_ids)
+                self.timestamps.extend(timestamps)
+
+    def read_cache(self, path, cache_dir):
+        cache = load_cache(cache_dir, path, 'tags')
+        if cache is None:
+            return False
+        columns = cache[0]
+        self.user_ids, self.movie_ids = columns["user_ids"], columns["movie_ids"]
+        self.tag_ids, self.timestamps = columns["tag_ids"], columns["timestamps"]
+        vocabulary = self.vocabulary
+        vocabulary.tags = unpack_strings(columns["tags"], columns["tag_ends"])
+        vocabulary.index = dict(zip(vocabulary.tags, range(len(vocabulary.tags))))
+        for name in ("lengths", "words", "counts"):
+            getattr(vocabulary, name).frombytes(memoryview(columns[name]).cast('B'))
+        return True
+
+    def write_cache(self, path, cache_dir, signature):
+        tags, tag_ends = pack_strings(self.vocabulary.tags)
+        store_cache(cache_dir, path, 'tags', signature, {
+            "user_ids": self.user_ids, "movie_ids": self.movie_ids,
+            "tag_ids": self.tag_ids, "timestamps": self.timestamps,
+            "tags": tags, "tag_ends": tag_ends, "lengths": self.vocabulary.lengths,
+            "words": self.vocabulary.words, "counts": self.vocabulary.counts,
+        })
+
+    @memoized(top=True)
     def most_words(self, n):
         """
         The method returns top-n tags with most words inside. It is a dict
         where the keys are tags and the values are the number of words inside the tag.
         Sort it by numbers descendingly.
         """
-        big_tags = [[x[2], len(x[2].split(' '))] for x in self.data]
-        big_tags = sorted(big_tags, key=lambda x: -int(x[1]))[:n]
-        return collections.OrderedDict(big_tags)
+        vocabulary = self.vocabulary
+        count_rows(len(vocabulary))
+        big_tags = top_n(range(len(vocabulary)), n, key=vocabulary.words.__getitem__)
+        return collections.OrderedDict((vocabulary.tags[tag_id], vocabulary.words[tag_id]) for tag_id in big_tags)
 
+    @memoized(top=True)
     def longest(self, n):
         """
         The method returns top n longest tags in terms of the number of characters.
         It is a list of the tags. Sort it by numbers descendingly.
+        Tags of the same length are in order of their first appearance.
         """
-        big_tags = set(map(lambda x: x[2], self.data))
-        big_tags = sorted(big_tags, key=lambda x: -len(x))[:n]
-        return big_tags
+        vocabulary = self.vocabulary
+        count_rows(len(vocabulary))
+        return [vocabulary.tags[tag_id] for tag_id in top_n(range(len(vocabulary)), n, key=vocabulary.lengths.__getitem__)]
 
+    @memoized
     def most_words_and_longest(self, n):
         """
         The method returns the intersection between top n tags with most words inside and top n longest tags in terms of the number of characters.
-        It is a list of the tags.
+        It is a list of the tags, in the order of the longest tags.
         """
-        longest_tags = list(sorted(set(map(lambda x: x[2], self.data)), key=lambda x: -len(x)))[:n]
-        most_words_tags = list(self.most_words(n))[:n]
-        return list(set(longest_tags) & set(most_words_tags))
+        most_words_tags, longest_tags = self.most_words(n), self.longest(n)
+        count_rows(len(longest_tags))
+        return [tag for tag in longest_tags if tag in most_words_tags]
 
+    @memoized(top=True)
     def most_popular(self, n) -> collections.OrderedDict:
         """
         The method returns the most popular tags.
         It is a dict where the keys are tags and the values are the counts.
         Sorted by counts in descending order
         """
-        popular_tags = collections.Counter(map(lambda x: x[2], self.data))
-        return collections.OrderedDict(popular_tags.most_common(n))
+        vocabulary = self.vocabulary
+        count_rows(len(vocabulary))
+        popular_tags = top_n(range(len(vocabulary)), n, key=vocabulary.counts.__getitem__)
+        return collections.OrderedDict((vocabulary.tags[tag_id], vocabulary.counts[tag_id]) for tag_id in popular_tags)
+
+    @instrumented
+    def get_index(self):
+        count_rows(0 if self.index is not None else len(self.vocabulary))
+        if self.index is None:
+            self.index = TagIndex(self.vocabulary.tags)
+        return self.index
 
-    def tags_with(self, word) -> list:
+    @memoized
+    def tags_with(self, word, ignore_case=False, whole_word=False) -> list:
         """
         The method returns all the tags that include the word given as the argument.
         It is a list of the tags.
         Sorted by tag name alphabetically.
+        With ignore_case the case does not matter, with whole_word the word can not be a part of a longer word.
         """
-        tags_with_word = list(map(lambda x: x[2], filter(lambda x: word in x[2], self.data)))
-        tags_with_word.sort()
-        return list(set(tags_with_word))
+        return self.get_index().search(word, ignore_case, whole_word)
+
+
+MOVIE_INDEXES = {}
+
+
+class MovieIndex(object):
+    """
+    The movies of movies.csv by dense id, their position in the file. dense_ids maps a movieId
+    to its dense id, or to -1 for the ids that are not in the file, so it is the existence bitmap
+    of the movieIds as well. titles maps a dense id to the title. Negative movieIds are not indexed.
+    """
+
+    def __init__(self, movie_ids, titles):
+        self.movie_ids = movie_ids
+        self.titles = titles
+        self.dense_ids = array.array('i', [-1]) * (max(movie_ids, default=-1) + 1)
+        for dense_id, movie_id in enumerate(movie_ids):
+            if movie_id >= 0:
+                self.dense_ids[movie_id] = dense_id
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    def get_dense_id(self, movie_id):
+        return self.dense_ids[movie_id] if 0 <= movie_id < len(self.dense_ids) else -1
+
+    def get_dense_ids(self, movie_ids):
+        dense_ids, size = self.dense_ids, len(self.dense_ids)
+        return array.array('i', (dense_ids[movie_id] if 0 <= movie_id < size else -1 for movie_id in movie_ids))
+
+    def get_title(self, movie_id):
+        dense_id = self.get_dense_id(movie_id)
+        return None if dense_id < 0 else self.titles[dense_id]
+
+
+def get_movie_index(path):
+    """
+    Returns the MovieIndex of a movies.csv. It is built once per version of the file
+    and shared by Movies and Ratings.Movies.
+    """
+    try:
+        signature = get_file_signature(path)
+    except OSError:
+        return Movies(path).movie_index
+    registered = MOVIE_INDEXES.get(os.path.abspath(path))
+    if registered is not None and registered[0] == signature:
+        return registered[1]
+    return Movies(path).movie_index
+
+
+RELEASE_YEAR_PATTERN = re.compile(r'\((\d{4})\)')
+MAX_GENRES = 64
+
+
+def get_mask_ids(mask):
+    """
+    Yields the ids of the genres of a genre bitmask, lowest first
+    """
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class GenreVocabulary(object):
+    """
+    The distinct genres of movies.csv. The id of a genre is its position in order of first appearance
+    and the genres of a movie are kept as a bitmask where the bit of the id is set for every genre,
+    so there can be at most MAX_GENRES of them (MovieLens has 20).
+    """
+
+    def __init__(self):
+        self.index = {}
+        self.genres = []
+
+    def __len__(self):
+        return len(self.genres)
+
+    def add(self, genre):
+        genre_id = self.index.get(genre)
+        if genre_id is None:
+            if len(self.genres) == MAX_GENRES:
+                raise ValueError(f"There are more than {MAX_GENRES} genres")
+            genre_id = self.index[genre] = len(self.genres)
+            self.genres.append(genre)
+        return genre_id
+
+    def get_mask(self, genres):
+        mask = 0
+        for genre in genres:
+            mask |= 1 << self.add(genre)
+        return mask
+
+    def get_genres(self, mask):
+        return [self.genres[genre_id] for genre_id in get_mask_ids(mask)]
+
+
+def parse_movies_text(text, vocabulary, malformed=None):
+    """
+    Parses csv text of movies.csv into the columns movie_ids, titles, years and genre_masks, with
+    the RFC 4180 quoting. A title with unquoted commas is still taken whole, as everything between
+    the first and the last field. The year is taken from the title once and is 0 when the title
+    has none. The malformed rows are skipped and counted in malformed.
+    """
+    malformed = MalformedRows() if malformed is None else malformed
+    columns = (array.array('i'), [], array.array('h'), array.array('Q'))
+    for row in get_csv_rows(text, 3, malformed):
+        try:
+            movie_id = int(row[0])
+        except ValueError:
+            movie_id = -1
+        if movie_id < 0:
+            malformed.add("value", row)
+            continue
+        title = ','.join(row[1:-1])
+        match = RELEASE_YEAR_PATTERN.search(title)
+        genre_mask = vocabulary.get_mask(genre.strip() for genre in row[-1].split('|'))
+        append_row(columns, (movie_id, title, int(match.group(1)) if match else 0, genre_mask), malformed, row)
+    return columns
+
+
+def parse_links_text(text, malformed=None):
+    """
+    Parses csv text of links.csv into a list of (movieId, imdbId) pairs of strings, with the RFC 4180
+    quoting. The tmdbId is not used, so it can be empty or missing. The malformed rows are skipped
+    and counted in malformed.
+    """
+    malformed = MalformedRows() if malformed is None else malformed
+    links = []
+    for row in get_csv_rows(text, 2, malformed):
+        movie_id, imdb_id = row[0].strip(), row[1].strip()
+        if len(row) > 3:
+            malformed.add("fields", row)
+        elif not movie_id.isdigit() or not imdb_id.isdigit():
+            malformed.add("value", row)
+        else:
+            links.append((movie_id, imdb_id))
+    return links
+
+
+class MoviesRows(collections.abc.Sequence):
+    """
+    Read-only legacy view of the movie columns as [movieId, title, [genres]] rows,
+    the genres are in order of their first appearance in the file
+    """
+
+    def __init__(self, movies):
+        self.movies = movies
+
+    def __len__(self):
+        return len(self.movies.movie_ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return [str(self.movies.movie_ids[index]),
+                self.movies.titles[index],
+                self.movies.vocabulary.get_genres(self.movies.genre_masks[index])]
 
 
 class Movies:
     """
     Analyzing data from movies.csv
-    """
 
-    def __init__(self, path):
-        def get_replaced_line(line, sep_old, sep_new, beg_count, end_count):
-            words = line.split(sep_old)
-            l_new = ""
-            for w_count in range(len(words)):
-                l_new += words[w_count]
-                if w_count != len(words) - 1:
-                    if (w_count < beg_count) or (w_count + 1 >= len(words) - end_count):
-                        l_new += sep_new
-                    else:
-                        l_new += sep_old
-            return l_new
-
-        def get_generator_list_lines(file_name):
-            with open(file_name, 'r') as f:
-                f.readline()
-                for line in f:
-                    yield line
+    The file is parsed once into the columns movie_ids, titles, years (the release year from the title,
+    0 if there is none) and genre_masks (see GenreVocabulary), so the genre queries are bitwise
+    operations over the distinct genre combinations.
+    With a cache_dir the columns are kept in a binary cache, as in Ratings.
+    The movie_index of the file is registered for get_movie_index, so Ratings.Movies reuses it.
+    The results of the methods are memoized, see memoized.
+    """
 
+    @instrumented
+    def __init__(self, path, cache_dir=None):
+        cache_dir = get_cache_dir(cache_dir)
+        self.vocabulary = GenreVocabulary()
+        self.movie_ids = array.array('i')
+        self.titles = []
+        self.years = array.array('h')
+        self.genre_masks = array.array('Q')
+        self.movie_index = MovieIndex(self.movie_ids, self.titles)
+        self.malformed = MalformedRows()
         try:
-            self.data = []
-            for line in get_generator_list_lines(path):
-                ss = get_replaced_line(line, ',', '\t', 1, 1)
-                new_elem = list(map(lambda x: x, ss.split('\t')))
-                new_elem[2] = list(map(lambda x: x.strip(), new_elem[2].split('|')))
-                self.data.append(new_elem)
+            signature = get_file_signature(path)
+            cached = cache_dir is not None and self.read_cache(path, cache_dir)
+            if not cached:
+                for block in get_generator_blocks(path):
+                    columns = parse_movies_text(block, self.vocabulary, self.malformed)
+                    for column, values in zip((self.movie_ids, self.titles, self.years, self.genre_masks), columns):
+                        column.extend(values)
         except IOError:
             print(f"There is no file {path}")
-        except Exception:
-            print(sys.int_info)
+            return
+        count_rows(0 if cached else len(self.movie_ids))
+        if not cached:
+            if cache_dir is not None:
+                self.write_cache(path, cache_dir, signature)
+            self.malformed.report(path)
+        self.movie_index = MovieIndex(self.movie_ids, self.titles)
+        MOVIE_INDEXES[os.path.abspath(path)] = (signature, self.movie_index)
+
+    @property
+    def data(self):
+        """
+        Legacy row view for old callers, the rows are built on access
+        """
+        return MoviesRows(self)
+
+    @property
+    def rows(self):
+        return len(self.movie_ids)
+
+    def read_cache(self, path, cache_dir):
+        cache = load_cache(cache_dir, path, 'movies')
+        if cache is None or "genre_masks" not in cache[0]:
+            return False
+        columns = cache[0]
+        self.movie_ids, self.years, self.genre_masks = columns["movie_ids"], columns["years"], columns["genre_masks"]
+        self.titles = unpack_strings(columns["titles"], columns["title_ends"])
+        for genre in unpack_strings(columns["genres"], columns["genre_ends"]):
+            self.vocabulary.add(genre)
+        return True
+
+    def write_cache(self, path, cache_dir, signature):
+        titles, title_ends = pack_strings(self.titles)
+        genres, genre_ends = pack_strings(self.vocabulary.genres)
+        store_cache(cache_dir, path, 'movies', signature, {
+            "movie_ids": self.movie_ids, "years": self.years, "genre_masks": self.genre_masks,
+            "titles": titles, "title_ends": title_ends, "genres": genres, "genre_ends": genre_ends,
+        })
+
+    def genre_counts(self):
+        """
+        Returns the number of movies of every genre, by genre id
+        """
+        count_rows(len(self.genre_masks))
+        counts = [0] * len(self.vocabulary)
+        for mask, count in collections.Counter(self.genre_masks).items():
+            for genre_id in get_mask_ids(mask):
+                counts[genre_id] += count
+        return counts
 
+    @memoized
     def dist_by_release(self):
         """
         The method returns a dict where the keys are years and the values are counts.
         Sorted by counts in descending order.
         """
-        release_years = []
-        for x in self.data:
-            try:
-                release_years.append(re.search(r'\((\d{4})\)', x[1]).group(1))
-            except:
-                release_years.append('(year not specified)')
-        return collections.OrderedDict(collections.Counter(release_years).most_common(len(release_years)))
+        count_rows(len(self.years))
+        return collections.OrderedDict((str(year) if year else '(year not specified)', count)
+                                       for year, count in collections.Counter(self.years).most_common())
 
+    @memoized
     def dist_by_genres(self):
         """
         The method returns a dict where the keys are genres and the values are counts.
         Sorted by counts descendingly.
         """
-        genres = {}
-        for record in self.data:
-            for genre in record[2]:
-                genres[genre] = genres.setdefault(genre, 0) + 1
-        tmp_genres = [[x, genres[x]] for x in genres]
-        tmp_genres.sort(key=lambda x: -int(x[1]))
-        return collections.OrderedDict(tmp_genres)
+        counts = self.genre_counts()
+        genre_ids = top_n(range(len(counts)), None, key=counts.__getitem__)
+        return collections.OrderedDict((self.vocabulary.genres[genre_id], counts[genre_id]) for genre_id in genre_ids)
 
+    @memoized(top=True)
     def most_genres(self, n):
         """
         The method returns a dict with top n movies where the keys are movie titles and the values are the number of genres of the movie. Sort it by numbers descendingly.
         """
-        movies = [[x[1], len(x[2])] for x in self.data]
-        movies = sorted(movies, key=lambda elem: -int(elem[1]))[:n]
-        return collections.OrderedDict(movies)
+        count_rows(len(self.genre_masks))
+        popcounts = {mask: bin(mask).count('1') for mask in set(self.genre_masks)}
+        movies = ((title, popcounts[mask]) for title, mask in zip(self.titles, self.genre_masks))
+        return collections.OrderedDict(top_n(movies, n, key=lambda elem: elem[1]))
 
+    @memoized
+    def with_genres(self, genres, any_genre=False):
+        """
+        The method returns the titles of the movies that have all the genres given, or any of them with any_genre.
+        It is a list in the order of the file.
+        """
+        mask = 0
+        for genre in genres:
+            if genre in self.vocabulary.index:
+                mask |= 1 << self.vocabulary.index[genre]
+            elif not any_genre:
+                return []
+        count_rows(len(self.genre_masks))
+        if any_genre:
+            return [title for title, movie_mask in zip(self.titles, self.genre_masks) if movie_mask & mask]
+        return [title for title, movie_mask in zip(self.titles, self.genre_masks) if movie_mask & mask == mask]
 
-class Links:
+    @memoized
+    def genres_with(self, genre):
+        """
+        The method returns a dict where the keys are the other genres of the movies of the genre
+        and the values are the numbers of such movies. Sorted by numbers descendingly.
+        """
+        if genre not in self.vocabulary.index:
+            return collections.OrderedDict()
+        genre_id = self.vocabulary.index[genre]
+        count_rows(len(self.genre_masks))
+        counts = [0] * len(self.vocabulary)
+        for mask, count in collections.Counter(self.genre_masks).items():
+            if mask >> genre_id & 1:
+                for other_id in get_mask_ids(mask):
+                    counts[other_id] += count
+        counts[genre_id] = 0
+        other_ids = top_n((other_id for other_id in range(len(counts)) if counts[other_id]), None,
+                          key=counts.__getitem__)
+        return collections.OrderedDict((self.vocabulary.genres[other_id], counts[other_id]) for other_id in other_ids)
+
+
+class MoviesRatings(object):
     """
-    Analyzing data from Links.csv
+    Rating statistics of Movies by genre and by release year.
+
+    Every movie is mapped to its group in the ratings summary once, then the per-movie rating
+    histograms are added up by release year and by genre mask. The movies with the same genres
+    share one histogram, so the per-genre histograms are summed over the distinct genre masks only.
+    The genre co-occurrence matrix is counted in the same pass over the movies.
+    The statistics are built for a version of the ratings and rebuilt on the first call after
+    the ratings were appended to, see Ratings.append.
     """
 
-    def __init__(self, path):
+    @instrumented
+    def __init__(self, movies, ratings):
+        self.movies = movies
+        self.ratings = ratings
+        self.built_version = None
+        self.lock = threading.Lock()
+        self.update()
+
+    @property
+    def version(self):
+        return self.ratings.version
+
+    @property
+    def rows(self):
+        return self.ratings.rows
+
+    def update(self):
+        """
+        Builds the statistics again if the ratings changed since they were built
+        """
+        with self.lock:
+            if self.built_version != self.ratings.version:
+                self.build()
+
+    @instrumented
+    def build(self):
+        movies = self.movies
+        count_rows(len(movies.movie_ids))
+        self.built_version = self.ratings.version
+        rating_groups = self.ratings.get_summary().movies
+        self.groups = array.array('i', (rating_groups.index.get(movie_id, -1) for movie_id in movies.movie_ids))
+        self.genres = RatingGroups()
+        self.years = RatingGroups()
+        genre_count = len(movies.vocabulary)
+        self.matrix = [[0] * genre_count for _ in range(genre_count)]
+        mask_counts = collections.Counter()
+        mask_histograms = {}
+        for group, year, mask in zip(self.groups, movies.years, movies.genre_masks):
+            mask_counts[mask] += 1
+            if group < 0:
+                continue
+            histogram = rating_groups.histogram(group)
+            self.years.add_histogram(year, histogram)
+            mask_histogram = mask_histograms.setdefault(mask, [0] * RATING_CODES)
+            for code in range(RATING_CODES):
+                mask_histogram[code] += histogram[code]
+        for mask, count in mask_counts.items():
+            genre_ids = list(get_mask_ids(mask))
+            for genre_id in genre_ids:
+                row = self.matrix[genre_id]
+                for other_id in genre_ids:
+                    row[other_id] += count
+        for mask, histogram in mask_histograms.items():
+            for genre_id in get_mask_ids(mask):
+                self.genres.add_histogram(genre_id, histogram)
+        self.genres.summarize()
+        self.years.summarize()
+
+    @instrumented
+    def ratings_by_genres(self, metric="average"):
+        """
+        The method returns a dict where the keys are genres and the values are the average, median
+        or percentile (like "p90") of the ratings of the movies of the genre.
+        Sorted by the values descendingly.
+        """
+        self.update()
+        count_rows(len(self.genres))
+        get_metric = get_metric_function(metric)
+        genres = self.movies.vocabulary.genres
+        genre_ratings = ((genres[self.genres.keys[group]], get_metric(self.genres, group))
+                         for group in range(len(self.genres)))
+        return collections.OrderedDict(top_n(genre_ratings, None, key=lambda x: x[1]))
+
+    @instrumented
+    def ratings_by_release(self, metric="average"):
+        """
+        The method returns a dict where the keys are release years and the values are the average, median
+        or percentile (like "p90") of the ratings of the movies released that year.
+        Sorted by years ascendingly, the movies without a year are the last.
+        """
+        self.update()
+        count_rows(len(self.years))
+        get_metric = get_metric_function(metric)
+        groups = sorted(range(len(self.years)), key=lambda group: (not self.years.keys[group], self.years.keys[group]))
+        return collections.OrderedDict((str(self.years.keys[group]) if self.years.keys[group] else '(year not specified)',
+                                        get_metric(self.years, group)) for group in groups)
+
+    @instrumented
+    def genre_dist_by_rating(self, genre):
+        """
+        The method returns the distribution of the ratings of the movies of the genre.
+        It is a dict where the keys are ratings and the values are counts. Sorted by ratings ascendingly.
+        """
+        self.update()
+        group = self.genres.index.get(self.movies.vocabulary.index.get(genre))
+        count_rows(0 if group is None else 1)
+        return get_rating_distribution([0] * RATING_CODES if group is None else self.genres.histogram(group))
+
+    @instrumented
+    def release_dist_by_rating(self, year):
+        """
+        The method returns the distribution of the ratings of the movies released in the year, 0 for no year.
+        It is a dict where the keys are ratings and the values are counts. Sorted by ratings ascendingly.
+        """
+        self.update()
+        group = self.years.index.get(int(year))
+        count_rows(0 if group is None else 1)
+        return get_rating_distribution([0] * RATING_CODES if group is None else self.years.histogram(group))
+
+    @instrumented
+    def genres_matrix(self):
+        """
+        The method returns the genre co-occurrence matrix: a dict of dicts where the value for two genres
+        is the number of movies having both of them, and the value for a genre with itself is its number of movies.
+        The genres are in order of their first appearance in movies.csv.
+        """
+        self.update()
+        count_rows(len(self.matrix))
+        genres = self.movies.vocabulary.genres
+        return collections.OrderedDict((genre, collections.OrderedDict(zip(genres, row)))
+                                       for genre, row in zip(genres, self.matrix))
+
+
+IMDB_URL = 'http://imdb.com/title/tt{}/'
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+FETCH_STATS = ("requests", "errors", "bytes", "http_seconds", "cache_hits", "cache_misses")
+
+
+IMDB_BUDGET = re.compile('Budget:')
+IMDB_GROSS = re.compile('Cumulative Worldwide Gross:')
+IMDB_RUNTIME = re.compile('Runtime:')
+IMDB_TITLE_PATTERN = re.compile(r'<div class="title_wrapper">\s*<h1[^>]*>(.*?)</h1>', re.S)
+IMDB_DIRECTOR_PATTERN = re.compile(
+    r'<div class="rec-jaw-lower">.*?<div class="(?:[^"]* )?rec-director(?: [^"]*)?">(.*?)</div>', re.S)
+IMDB_DETAILS_PATTERN = re.compile(r'<div [^>]*\bid="titleDetails"[^>]*>')
+IMDB_INLINE_H4 = r'<h4 class="(?:[^"]* )?inline(?: [^"]*)?">'
+IMDB_BUDGET_PATTERN = re.compile(IMDB_INLINE_H4 + r'[^<]*Budget:[^<]*</h4>([^<]*)')
+IMDB_GROSS_PATTERN = re.compile(IMDB_INLINE_H4 + r'[^<]*Cumulative Worldwide Gross:[^<]*</h4>([^<]*)')
+IMDB_RUNTIME_PATTERN = re.compile(IMDB_INLINE_H4 + r'[^<]*Runtime:[^<]*</h4>(?:(?!</div>).)*?<time[^>]*>(.*?)</time>', re.S)
+IMDB_DIV_PATTERN = re.compile(r'<(/?)div\b')
+IMDB_TAG_PATTERN = re.compile(r'<[^>]*>')
+
+
+def get_imdb_record(title, director, budget, gross, runtime):
+    return [title[:title.find('\xa0')],
+            director[director.rfind('\n'):].strip(),
+            budget[budget.find('$') + 1:].replace(',', '').strip(),
+            gross[gross.find('$') + 1:].replace(',', '').strip(),
+            runtime]
+
+
+def parse_imdb_page_soup(text):
+    """
+    Extracts [title, director, budget, gross, runtime] from an IMDb title page with a full
+    BeautifulSoup tree. Returns None if the page has no title.
+    """
+    import bs4
+    soup = bs4.BeautifulSoup(text, 'html.parser')
+    details = soup.find("div", attrs={"id": "titleDetails"})
+    try:
+        title = soup.find("div", attrs={"class": "title_wrapper"}).find("h1").text
+    except AttributeError:
+        return None
+    try:
+        director = soup.find("div", attrs={"class": "rec-jaw-lower"}).find("div", attrs={
+            "class": "rec-director"}).text
+    except AttributeError:
+        director = ''
+    try:
+        budget = str(details.find("h4", string=IMDB_BUDGET, attrs={"class": "inline"}).next_sibling)
+    except AttributeError:
+        budget = '0'
+    try:
+        gross = str(details.find("h4", string=IMDB_GROSS, attrs={"class": "inline"}).next_sibling)
+    except AttributeError:
+        gross = '0'
+    try:
+        runtime = details.find("h4", string=IMDB_RUNTIME, attrs={"class": "inline"}).find_parent().find(
+            "time").text
+    except AttributeError:
+        runtime = '1 min'
+    return get_imdb_record(title, director, budget, gross, runtime)
+
+
+def get_div_end(text, start):
+    """
+    Returns where the div open at start is closed, the end of the text if it is not
+    """
+    depth = 1
+    for match in IMDB_DIV_PATTERN.finditer(text, start):
+        depth += -1 if match.group(1) else 1
+        if not depth:
+            return match.start()
+    return len(text)
+
+
+def parse_imdb_page_fast(text):
+    """
+    Extracts the same fields as parse_imdb_page_soup with precompiled patterns over the raw page,
+    without building a tree. The budget, gross and runtime are searched for inside the titleDetails
+    div only. Returns None if the page does not have the expected layout: no title, a director
+    with nested tags, or a field label the patterns do not match.
+    """
+
+    def get_text(fragment):
+        return html.unescape(IMDB_TAG_PATTERN.sub('', fragment))
+
+    title = IMDB_TITLE_PATTERN.search(text)
+    if title is None:
+        return None
+    director = IMDB_DIRECTOR_PATTERN.search(text)
+    if director is None and 'rec-director' in text or director is not None and '<div' in director.group(1):
+        return None
+    details = IMDB_DETAILS_PATTERN.search(text)
+    budget = gross = runtime = None
+    if details is not None:
+        start, end = details.end(), get_div_end(text, details.end())
+        budget = IMDB_BUDGET_PATTERN.search(text, start, end)
+        gross = IMDB_GROSS_PATTERN.search(text, start, end)
+        runtime = IMDB_RUNTIME_PATTERN.search(text, start, end)
+        for field, label in ((budget, 'Budget:'), (gross, 'Cumulative Worldwide Gross:'), (runtime, 'Runtime:')):
+            if field is None and text.find(label, start, end) >= 0:
+                return None
+    return get_imdb_record(get_text(title.group(1)),
+                           '' if director is None else get_text(director.group(1)),
+                           '0' if budget is None else html.unescape(budget.group(1)),
+                           '0' if gross is None else html.unescape(gross.group(1)),
+                           '1 min' if runtime is None else get_text(runtime.group(1)))
+
+
+def parse_imdb_page(text):
+    """
+    Extracts [title, director, budget, gross, runtime] from an IMDb title page.
+    The fast extractor is tried first, the BeautifulSoup one is the fallback for the pages
+    the fast one can not read for sure.
+    Returns None if the page has no title.
+    """
+    record = parse_imdb_page_fast(text)
+    if record is None:
+        record = parse_imdb_page_soup(text)
+    return record
+
+
+class ImdbFetcher(object):
+    """
+    Fetches and parses IMDb title pages for Links.
+
+    The pages are fetched by a pool of workers threads over one pooled requests session,
+    which is created, and requests imported, with the first request.
+    rate limits the requests per second over all the workers, failed requests are retried
+    with exponential backoff. With a cache_dir every parsed record is saved as
+    <cache_dir>/imdb/<imdbId>.json and is never fetched again.
+
+    stats counts the requests, the bytes and the http_seconds spent on them, the failed requests
+    and the cache hits and misses. When the instrumentation is on, every request and every
+    fetch is reported to its sink as well.
+    """
+
+    def __init__(self, base_url=IMDB_URL, workers=8, rate=None, retries=3, backoff=0.5, timeout=10,
+                 cache_dir=None):
+        self.base_url = base_url
+        self.workers = workers
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.cache_dir = None if cache_dir is None else os.path.join(cache_dir, 'imdb')
+        self.session = None
+        self.lock = threading.Lock()
+        self.next_turn = 0.0
+        self.failures = []
+        self.stats = collections.Counter()
+
+    def count(self, **stats):
+        with self.lock:
+            self.stats.update(stats)
+
+    def cache_hit_ratio(self):
+        lookups = self.stats["cache_hits"] + self.stats["cache_misses"]
+        return self.stats["cache_hits"] / lookups if lookups else None
+
+    def get_session(self):
+        import requests.adapters
+        with self.lock:
+            if self.session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self.session = session
+            return self.session
+
+    def wait_turn(self):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            turn = max(now, self.next_turn)
+            self.next_turn = turn + 1 / self.rate
+        time.sleep(turn - now)
+
+    def get_page(self, imdb_id):
+        """
+        Returns the text of the title page, or None if it can not be fetched. Connection errors,
+        timeouts, broken chunked responses and the RETRY_STATUSES are retried, the other errors
+        of requests (bad urls, redirect loops, undecodable content) are not.
+        """
+        import requests
+        url = self.base_url.format(imdb_id)
+        session = self.get_session()
+        transient = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+        for attempt in range(self.retries + 1):
+            self.wait_turn()
+            start = time.perf_counter()
+            try:
+                response = session.get(url, timeout=self.timeout)
+            except requests.RequestException as error:
+                seconds = time.perf_counter() - start
+                self.count(requests=1, errors=1, http_seconds=seconds)
+                emit_event({"name": "ImdbFetcher.get_page", "seconds": seconds, "status": None, "bytes": 0})
+                if not isinstance(error, transient):
+                    return None
+            else:
+                seconds = time.perf_counter() - start
+                self.count(requests=1, errors=int(not response.ok), http_seconds=seconds, bytes=len(response.content))
+                emit_event({"name": "ImdbFetcher.get_page", "seconds": seconds,
+                            "status": response.status_code, "bytes": len(response.content)})
+                if response.status_code not in RETRY_STATUSES:
+                    return response.text if response.ok else None
+            if attempt < self.retries:
+                time.sleep(self.backoff * 2 ** attempt)
+        return None
+
+    def get_cache_path(self, imdb_id):
+        return os.path.join(self.cache_dir, f"{imdb_id}.json")
+
+    def read_cache(self, imdb_id):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self.get_cache_path(imdb_id), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write_cache(self, imdb_id, record):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temp_path = f"{self.get_cache_path(imdb_id)}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(record, f)
+        os.replace(temp_path, self.get_cache_path(imdb_id))
+
+    def fetch_one(self, imdb_id):
+        record = self.read_cache(imdb_id)
+        if record is not None:
+            self.count(cache_hits=1)
+            return record
+        if self.cache_dir is not None:
+            self.count(cache_misses=1)
+        text = self.get_page(imdb_id)
+        record = None if text is None else parse_imdb_page(text)
+        if record is None:
+            with self.lock:
+                self.failures.append(imdb_id)
+        elif self.cache_dir is not None:
+            self.write_cache(imdb_id, record)
+        return record
+
+    def fetch(self, imdb_ids):
+        """
+        Returns a dict from imdbId to its record, the ids which could not be fetched are left out
+        and kept in failures
+        """
+        imdb_ids = list(dict.fromkeys(imdb_ids))
+        stats, start = self.stats.copy(), time.perf_counter()
+        import concurrent.futures
+        with concurrent.futures.ThreadPoolExecutor(self.workers) as executor:
+            records = executor.map(self.fetch_one, imdb_ids)
+            records = {imdb_id: record for imdb_id, record in zip(imdb_ids, records) if record is not None}
+        if INSTRUMENTATION is not None:
+            event = {"name": "ImdbFetcher.fetch", "seconds": time.perf_counter() - start, "rows": len(imdb_ids),
+                     "fetched": len(records)}
+            event.update((key, self.stats[key] - stats[key]) for key in FETCH_STATS)
+            lookups = event["cache_hits"] + event["cache_misses"]
+            event["cache_hit_ratio"] = event["cache_hits"] / lookups if lookups else None
+            emit_event(event)
+        return records
+
+
+class Links:
+    """
+    Analyzing data from Links.csv
 
-        def generate_line(path):
-            with open(path, "r") as links_file:
-                links_file.readline()
-                for line in links_file:
-                    yield line
+    Only links.csv is read on construction. The details of a movie are fetched from IMDb
+    by an ImdbFetcher the first time they are needed and are memoized per movieId.
+    Pass your own fetcher to change the concurrency, the rate limit, the cache or the server.
+    The movies whose pages can not be fetched are left out.
+    The results of the methods are memoized, see memoized.
+    """
 
+    @instrumented
+    def __init__(self, path, fetcher=None):
+        self.fetcher = fetcher if fetcher is not None else ImdbFetcher(cache_dir=get_cache_dir())
+        self.links = collections.OrderedDict()
+        self.details = {}
+        self.malformed = MalformedRows()
         try:
-            self.data = []
-            for line in generate_line(path):
-                movie_id, imdb_id, unused = line.split(',')
-                req = requests.get(f'http://imdb.com/title/tt{imdb_id}/')
-                soup = bs4.BeautifulSoup(req.text, 'html.parser')
-                details = soup.find("div", attrs={"id": "titleDetails"})
-                title = soup.find("div", attrs={"class": "title_wrapper"}).find("h1").text
-                try:
-                    director = soup.find("div", attrs={"class": "rec-jaw-lower"}).find("div", attrs={
-                        "class": "rec-director"}).text
-                except AttributeError:
-                    director = ''
-                try:
-                    budget = str(details.find("h4", text=re.compile('Budget:'), attrs={"class": "inline"}).next_sibling)
-                except AttributeError:
-                    budget = '0'
-                try:
-                    gross = str(details.find("h4", text=re.compile('Cumulative Worldwide Gross:'),
-                                             attrs={"class": "inline"}).next_sibling)
-                except AttributeError:
-                    gross = '0'
-                try:
-                    runtime = details.find("h4", text=re.compile('Runtime:'), attrs={"class": "inline"}).findParent().find(
-                        "time").text
-                except AttributeError:
-                    runtime = '1 min'
-                self.data.append([movie_id,
-                                  title[:title.find('\xa0')],
-                                  director[director.rfind('\n'):].strip(),
-                                  budget[budget.find('$') + 1:].replace(',', '').strip(),
-                                  gross[gross.find('$') + 1:].replace(',', '').strip(),
-                                  runtime])
+            for block in get_generator_blocks(path):
+                self.links.update(parse_links_text(block, self.malformed))
+            count_rows(len(self.links))
+            self.malformed.report(path)
         except IOError:
             print("file error")
 
-    def get_imdb(self):
+    @property
+    def rows(self):
+        return len(self.links)
+
+    @instrumented
+    def prefetch(self, movie_ids):
+        """
+        Fetches the details of the given movies in one concurrent batch,
+        the movies fetched before (or failed before) are not fetched again
+        """
+        missing = [movie_id for movie_id in dict.fromkeys(map(str, movie_ids))
+                   if movie_id in self.links and movie_id not in self.details]
+        count_rows(len(missing))
+        if not missing:
+            return
+        records = self.fetcher.fetch(self.links[movie_id] for movie_id in missing)
+        for movie_id in missing:
+            record = records.get(self.links[movie_id])
+            self.details[movie_id] = None if record is None else [movie_id] + record
+
+    def get_details(self, movie_id):
+        """
+        The method returns [movieId, movie Title, Director, Budget, Cumulative Worldwide Gross, Runtime]
+        of one movie, or None if it is unknown or its page can not be fetched
+        """
+        self.prefetch([movie_id])
+        return self.details.get(str(movie_id))
+
+    @property
+    def data(self):
+        """
+        The details of all the movies, fetching the ones not fetched yet
+        """
+        self.prefetch(self.links)
+        return [self.details[movie_id] for movie_id in self.links if self.details[movie_id] is not None]
+
+    @memoized
+    def get_imdb(self, movie_ids=None):
         """
         The method returns a lst of lists with fields:
         [movieId, movie Title, Director, Budget, Cumulative Worldwide Gross, Runtime]
         Sorted by movieId
+        With movie_ids only these movies are fetched and returned.
         """
-        return list(sorted(self.data, key=lambda x: int(x[0])))
+        if movie_ids is None:
+            data = self.data
+        else:
+            self.prefetch(movie_ids)
+            details = (self.details.get(movie_id) for movie_id in dict.fromkeys(map(str, movie_ids)))
+            data = [x for x in details if x is not None]
+        count_rows(len(data))
+        return list(sorted(data, key=lambda x: int(x[0])))
 
+    @memoized(top=True)
     def top_directors(self, n):
         """
         The method returns a dict where the keys are directors and the values are numbers movies created by them
         Sorted by numbers in descending order.
         """
-        directors = collections.Counter(map(lambda x: x[2], self.data))
+        data = self.data
+        count_rows(len(data))
+        directors = collections.Counter(map(lambda x: x[2], data))
         return collections.OrderedDict(directors.most_common(n))
 
+    @memoized(top=True)
     def most_expensive(self, n):
         """
         The method returns a dict with top n movies where the keys are movie titles and the values are their budgets.
         Sorted by budgets in descending order.
         """
-        budgets = collections.OrderedDict({x[1]: x[3] for x in sorted(self.data, key=lambda x: -int(x[3]))[:n]})
+        data = self.data
+        count_rows(len(data))
+        budgets = collections.OrderedDict((x[1], x[3]) for x in top_n(data, n, key=lambda x: int(x[3])))
         return budgets
 
+    @memoized(top=True)
     def most_profitable(self, n):
         """
         The method returns a dict with top n movies where the keys are movie titles and the values are their budgets.
         Sorted by budgets in descending order.
         """
-        profits = collections.OrderedDict({x[1]: int(x[4]) - int(x[3]) for x in sorted(self.data, key=lambda x: int(x[3]) - int(x[4]))[:n]})
+        data = self.data
+        count_rows(len(data))
+        profits = collections.OrderedDict((x[1], int(x[4]) - int(x[3]))
+                                          for x in top_n(data, n, key=lambda x: int(x[4]) - int(x[3])))
         return profits
 
+    @memoized(top=True)
     def longest(self, n):
         """
         The method returns a dict with top n movies where the keys are movie titles and the values are their runtime.
         Sorted by runtime in descending order.
         """
-        a = self.data[0][5][:self.data[0][5].find(' ')]
-        runtimes = collections.OrderedDict({x[1]: x[5] for x in sorted(self.data, key=lambda x: -int(x[5][:-4]))[:n]})
+        data = self.data
+        count_rows(len(data))
+        runtimes = collections.OrderedDict((x[1], x[5]) for x in top_n(data, n, key=lambda x: int(x[5][:-4])))
         return runtimes
 
+    @memoized(top=True)
     def top_cost_per_minute(self, n):
         """
         The method returns a dict with top n movies where the keys are movie titles and the values are the budgets divided by their runtime.
         Sorted by the division in descending order.
         """
-        costs = collections.OrderedDict({x[1]: int(x[3]) / int(x[5][:-4]) for x in
-                 sorted(self.data, key=lambda x: -(int(x[3]) / int(x[5][:-4])))[:n]})
+        data = self.data
+        count_rows(len(data))
+        costs = collections.OrderedDict((x[1], int(x[3]) / int(x[5][:-4]))
+                                        for x in top_n(data, n, key=lambda x: int(x[3]) / int(x[5][:-4])))
         return costs
 
 
+SERVER_METHODS = {
+    "ratings.movies": ("dist_by_year", "dist_by_month", "dist_by_day", "dist_by_rating", "top_by_num_of_ratings",
+                       "top_by_ratings", "top_controversial", "similar_movies"),
+    "ratings.users": ("top_valuers", "valuers_with_ratings", "top_controversial_valuers"),
+    "tags": ("most_words", "longest", "most_words_and_longest", "most_popular", "tags_with"),
+    "movies": ("dist_by_release", "dist_by_genres", "most_genres", "with_genres", "genres_with"),
+    "movies_ratings": ("ratings_by_genres", "ratings_by_release", "genre_dist_by_rating", "release_dist_by_rating",
+                       "genres_matrix"),
+}
+SERVER_STRING_PARAMETERS = ("word", "metric", "genre")
+SERVER_FLAG_PARAMETERS = ("ignore_case", "whole_word", "any_genre")
+SERVER_LIST_PARAMETERS = ("genres",)
+SERVER_BACKLOG = 128
+SERVER_THREADS = 4
+
+
+def load_mapped(cls, path, cache_dir):
+    """
+    Returns cls(path) with its columns mapped from the cache. A file without a fresh cache is parsed
+    and cached first, then the parsed copy is dropped for the mapped one.
+    """
+    loaded = cls(path, cache_dir=cache_dir)
+    if cache_dir is not None and not isinstance(loaded.movie_ids, memoryview):
+        loaded = cls(path, cache_dir=cache_dir)
+    return loaded
+
+
+def load_dataset(ratings=None, tags=None, movies=None, cache_dir=None, similarity=("cosine",)):
+    """
+    Loads the files to serve through their binary caches, so the columns are memory-mapped read-only
+    and the pages are shared by all the processes that load or inherit them. The summary, the time
+    index and the neighbor indexes of the similarity metrics are built here as well, so the workers
+    forked later share them instead of building their own on the first query. Returns the objects
+    by their names in SERVER_METHODS.
+    """
+    objects = {}
+    if movies:
+        objects["movies"] = load_mapped(Movies, movies, cache_dir)
+    if ratings:
+        ratings_class = load_mapped(Ratings, ratings, cache_dir)
+        ratings_class.get_summary()
+        ratings_class.get_time_index()
+        for metric in similarity:
+            ratings_class.get_neighbor_index(metric)
+        objects["ratings.users"] = ratings_class.Users(ratings_class)
+        if movies:
+            objects["ratings.movies"] = ratings_class.Movies(movies, ratings_class)
+            objects["movies_ratings"] = MoviesRatings(objects["movies"], ratings_class)
+    if tags:
+        objects["tags"] = load_mapped(Tags, tags, cache_dir)
+    return objects
+
+
+def get_hashable(value):
+    """
+    Turns the json lists of the arguments into tuples, so the results of the calls with them are memoized
+    """
+    return tuple(get_hashable(item) for item in value) if isinstance(value, list) else value
+
+
+def get_argument(name, value):
+    """
+    Decodes the value of a query string parameter by the name of the parameter: the SERVER_STRING_PARAMETERS
+    are taken as they are, the SERVER_FLAG_PARAMETERS are true or false, the SERVER_LIST_PARAMETERS
+    are a json list or comma separated values, the others are integers or null.
+    Raises ValueError for a value of the wrong type.
+    """
+    if name in SERVER_STRING_PARAMETERS:
+        return value
+    if name in SERVER_FLAG_PARAMETERS:
+        if value.lower() not in ("true", "false", "1", "0"):
+            raise ValueError(f"{name} must be true or false, not {value!r}")
+        return value.lower() in ("true", "1")
+    if name in SERVER_LIST_PARAMETERS:
+        return get_hashable(json.loads(value)) if value.startswith('[') else tuple(filter(None, value.split(',')))
+    return None if value == "null" else int(value)
+
+
+class QueryServer(object):
+    """
+    Serves the query methods of the loaded objects as json over HTTP/1.1 with keep-alive.
+
+        GET /                                         the objects and their methods
+        GET /ratings.movies/top_by_ratings?n=10&metric=p90    (the values are decoded by get_argument)
+        POST /ratings.movies/top_by_ratings           {"args": [10], "kwargs": {"metric": "p90"}}
+
+    The result is sent as {"result": ...}, errors as {"error": ...} with the status 404 for unknown
+    objects or methods, 400 for bad arguments and 500 for the other errors. Every process serves
+    its connections on one asyncio loop. The calls run on a pool of SERVER_THREADS threads, so a slow
+    call does not hold up the other connections, and they are memoized, so the repeated ones are cheap.
+    """
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.executor = None
+
+    def has_method(self, name, method):
+        return name in self.objects and method in SERVER_METHODS.get(name, ())
+
+    @instrumented
+    def call(self, name, method, args=(), kwargs=None):
+        if not self.has_method(name, method):
+            raise ValueError(f"There is no method {name}.{method}")
+        return getattr(self.objects[name], method)(*args, **(kwargs or {}))
+
+    def handle(self, verb, target, body):
+        """
+        Returns the status and the json payload of a request. An error of the method other than
+        a TypeError or a ValueError for its arguments is an internal error, 500.
+        """
+        url = urllib.parse.urlsplit(target)
+        path = url.path.strip('/')
+        if not path:
+            return http.HTTPStatus.OK, {"result": {name: SERVER_METHODS[name] for name in self.objects}}
+        name, _, method = path.rpartition('/')
+        if not self.has_method(name, method):
+            return http.HTTPStatus.NOT_FOUND, {"error": f"There is no method {name}.{method}"}
+        try:
+            if verb == 'POST':
+                request = json.loads(body or b'{}')
+                if not isinstance(request, dict):
+                    raise ValueError("The body must be a json object with args and kwargs")
+                args = [get_hashable(value) for value in request.get("args", [])]
+                kwargs = {key: get_hashable(value) for key, value in request.get("kwargs", {}).items()}
+            elif verb == 'GET':
+                args, kwargs = [], {key: get_argument(key, value) for key, value in urllib.parse.parse_qsl(url.query)}
+            else:
+                return http.HTTPStatus.METHOD_NOT_ALLOWED, {"error": f"{verb} is not supported"}
+            return http.HTTPStatus.OK, {"result": self.call(name, method, args, kwargs)}
+        except (TypeError, ValueError) as error:
+            return http.HTTPStatus.BAD_REQUEST, {"error": str(error)}
+        except Exception as error:
+            return http.HTTPStatus.INTERNAL_SERVER_ERROR, {"error": f"{error.__class__.__name__}: {error}"}
+
+    async def handle_connection(self, reader, writer):
+        import asyncio
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                verb, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    header, _, value = line.decode('latin-1').partition(':')
+                    headers[header.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                status, payload = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, self.handle, verb, target, body)
+                data = json.dumps(payload, default=list).encode()
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+                writer.write(f"HTTP/1.1 {status.value} {status.phrase}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ValueError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def run(self, sock):
+        import asyncio
+        import socket
+        import concurrent.futures
+        self.executor = concurrent.futures.ThreadPoolExecutor(SERVER_THREADS)
+        if sock.family == getattr(socket, 'AF_UNIX', None):
+            server = await asyncio.start_unix_server(self.handle_connection, sock=sock)
+        else:
+            server = await asyncio.start_server(self.handle_connection, sock=sock)
+        async with server:
+            await server.serve_forever()
+
+
+def get_server_socket(host="127.0.0.1", port=8000, unix_path=None):
+    import socket
+    if unix_path is None:
+        return socket.create_server((host, port), backlog=SERVER_BACKLOG)
+    if os.path.exists(unix_path):
+        os.unlink(unix_path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(unix_path)
+    sock.listen(SERVER_BACKLOG)
+    return sock
+
+
+def stop_serving(signum, frame):
+    raise SystemExit(0)
+
+
+def serve(objects, host="127.0.0.1", port=8000, unix_path=None, workers=1):
+    """
+    Serves the objects on a TCP port or a Unix socket with a QueryServer per process. The workers
+    are forked after the objects are loaded and accept on the same socket, so the dataset is loaded
+    once and its memory-mapped columns are shared by all of them.
+    """
+    import asyncio
+    import signal
+    if workers > 1 and not hasattr(os, 'fork'):
+        raise ValueError("Serving with several workers needs os.fork")
+    sock = get_server_socket(host, port, unix_path)
+    address = unix_path or "http://{}:{}".format(*sock.getsockname()[:2])
+    print(f"Serving {', '.join(objects)} on {address} with {workers} workers", flush=True)
+    server = QueryServer(objects)
+    children = []
+    previous_handler = signal.signal(signal.SIGTERM, stop_serving)
+    for _ in range(workers - 1):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                asyncio.run(server.run(sock))
+            finally:
+                os._exit(0)
+        children.append(pid)
+    try:
+        asyncio.run(server.run(sock))
+    finally:
+        signal.signal(signal.SIGTERM, previous_handler)
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        sock.close()
+
+
+def main(argv=None):
+    import argparse
+    import tempfile
+    parser = argparse.ArgumentParser(description="Serves the MovieLens statistics as json over HTTP")
+    parser.add_argument('--ratings', default='ratings.csv')
+    parser.add_argument('--tags', default='tags.csv')
+    parser.add_argument('--movies', default='movies.csv')
+    parser.add_argument('--cache-dir', default=get_cache_dir() or os.path.join(tempfile.gettempdir(), 'movielens-cache'))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--socket', help='a Unix socket path to serve on instead of the port')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--similarity', nargs='*', choices=SIMILARITY_METRICS, default=["cosine"],
+                        help='the similarity metrics whose neighbor indexes are built before serving')
+    args = parser.parse_args(argv)
+    objects = load_dataset(args.ratings, args.tags, args.movies, args.cache_dir, args.similarity)
+    try:
+        serve(objects, args.host, args.port, args.socket, args.workers)
+    except KeyboardInterrupt:
+        pass
+
+
 if __name__ == "__main__":
-   print("All is OK!") 
+    main()
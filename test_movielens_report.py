@@ -1,6 +1,54 @@
 from collections import OrderedDict
+import os
+import re
+import threading
+import http.server
 import pytest
-from movielens_analysis import Ratings, Tags, Movies, Links
+from movielens_analysis import Ratings, Tags, Movies, MoviesRatings, Links, ImdbFetcher, MovieIndex, top_n, clear_memo
+from movielens_analysis import parse_imdb_page, parse_imdb_page_fast, parse_imdb_page_soup
+from movielens_analysis import StatsSink, JsonLinesSink, instrumentation, profiled, get_generator_blocks
+from movielens_analysis import QueryServer, SERVER_METHODS, load_dataset, get_server_socket
+
+# a stand-in for imdb.com serving the saved pages from fixtures/imdb
+# -----------------------------------------------------
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'imdb')
+
+class ImdbFixtureHandler(http.server.BaseHTTPRequestHandler):
+	def do_GET(self):
+		self.server.requests.append(self.path)
+		if self.server.failures.get(self.path, 0) > 0:
+			self.server.failures[self.path] -= 1
+			self.send_error(503)
+			return
+		match = re.fullmatch(r'/title/(tt\d+)/', self.path)
+		page_path = match and os.path.join(FIXTURES_DIR, match.group(1) + '.html')
+		if not page_path or not os.path.exists(page_path):
+			self.send_error(404)
+			return
+		with open(page_path, 'rb') as f:
+			page = f.read()
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/html; charset=utf-8')
+		self.send_header('Content-Length', str(len(page)))
+		self.end_headers()
+		self.wfile.write(page)
+
+	def log_message(self, *args):
+		pass
+
+@pytest.fixture
+def imdb_server():
+	server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), ImdbFixtureHandler)
+	server.requests = []
+	server.failures = {}
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	yield server
+	server.shutdown()
+	server.server_close()
+
+def imdb_fetcher(server, **kwargs):
+	return ImdbFetcher(base_url='http://127.0.0.1:%d/title/tt{}/' % server.server_port, backoff=0, **kwargs)
 
 # to check if the methods return the correct data types
 # -----------------------------------------------------
@@ -207,3 +255,815 @@ def test_links_class_correct_list_error(links_file_name, n, list_of_fields):
 
 	assert True
 """
+
+# to check the columnar storage of the ratings
+# -----------------------------------------------------
+
+@pytest.mark.parametrize('ratings_file_name', ['ratings.csv'])
+def test_ratings_columns(ratings_file_name):
+	ratings_class = Ratings(ratings_file_name)
+	with open(ratings_file_name) as f:
+		f.readline()
+		rows = [line.strip().split(',') for line in f if line.strip()]
+	assert ratings_class.user_ids.typecode == 'i'
+	assert ratings_class.rating_codes.typecode == 'B'
+	assert ratings_class.timestamps.typecode == 'q'
+	assert len(ratings_class.data) == len(rows)
+	assert list(ratings_class.data) == rows
+	assert ratings_class.data[-1] == rows[-1]
+
+
+# to check the grouped statistics of the ratings
+# -----------------------------------------------------
+
+def write_ratings(path, rows):
+	with open(path, 'w') as f:
+		f.write('userId,movieId,rating,timestamp\n')
+		for row in rows:
+			f.write(','.join(map(str, row)) + '\n')
+	return str(path)
+
+def test_ratings_groups(tmp_path):
+	ratings_class = Ratings(write_ratings(tmp_path / 'ratings.csv', [
+		[1, 10, '4.0', 1000], [2, 10, '2.0', 1001], [3, 10, '3.5', 1002], [4, 10, '5.0', 1003],
+		[1, 20, '1.5', 1004], [1, 30, '0.5', 1005], [2, 30, '4.5', 1006]]))
+	movies = ratings_class.get_summary().movies
+	group = movies.index[10]
+	assert movies.counts[group] == 4
+	assert movies.mean(group) == 3.625
+	assert movies.median(group) == 3.75
+	assert movies.minimum(group) == 2.0 and movies.maximum(group) == 5.0
+	assert abs(movies.variance(group) - 1.5625) < 1e-12
+	assert movies.median(movies.index[30]) == 2.5
+	users_class = ratings_class.Users(ratings_class)
+	assert users_class.top_valuers() == OrderedDict([('1', 3), ('2', 2), ('3', 1), ('4', 1)])
+	assert ratings_class.get_summary() is ratings_class.get_summary()
+
+
+# to check the top-n selection
+# -----------------------------------------------------
+
+def test_top_n_ties():
+	items = [('a', 1), ('b', 3), ('c', 2), ('d', 3), ('e', 2)]
+	assert top_n(items, 3, key=lambda x: x[1]) == [('b', 3), ('d', 3), ('c', 2)]
+	assert top_n(items, None, key=lambda x: x[1]) == sorted(items, key=lambda x: -x[1])
+	assert top_n(iter(items), 0, key=lambda x: x[1]) == []
+
+
+# to check the stream mode of the ratings
+# -----------------------------------------------------
+
+def ratings_report(ratings_class, movies_file_name):
+	movies_class = ratings_class.Movies(movies_file_name, ratings_class)
+	users_class = ratings_class.Users(ratings_class)
+	return [movies_class.dist_by_year(), movies_class.dist_by_rating(),
+		movies_class.top_by_num_of_ratings(5), movies_class.top_by_ratings(5),
+		movies_class.top_by_ratings(5, metric="median"), movies_class.top_controversial(5),
+		users_class.top_valuers(), users_class.valuers_with_ratings(),
+		users_class.valuers_with_ratings(metric="median"), users_class.top_controversial_valuers(5)]
+
+def random_ratings(tmp_path, count=2000, seed=7):
+	import random
+	generator = random.Random(seed)
+	return write_ratings(tmp_path / 'ratings.csv', [
+		[generator.randint(1, 40), generator.randint(1, 19), generator.randint(1, 10) / 2,
+			generator.randint(800000000, 1600000000)] for _ in range(count)])
+
+def test_ratings_stream(tmp_path):
+	ratings_file_name = random_ratings(tmp_path)
+	eager = ratings_report(Ratings(ratings_file_name), 'movies.csv')
+	streamed_class = Ratings(ratings_file_name, stream=True, chunk_size=97)
+	assert ratings_report(streamed_class, 'movies.csv') == eager
+	assert len(streamed_class.user_ids) == 0
+	with pytest.raises(ValueError):
+		streamed_class.data
+
+
+# to check the parallel reading
+# -----------------------------------------------------
+
+@pytest.mark.parametrize('workers', [2, 5])
+def test_ratings_parallel(tmp_path, workers):
+	ratings_file_name = random_ratings(tmp_path)
+	serial_class = Ratings(ratings_file_name)
+	parallel_class = Ratings(ratings_file_name, workers=workers)
+	assert parallel_class.columns() == serial_class.columns()
+	assert ratings_report(parallel_class, 'movies.csv') == ratings_report(serial_class, 'movies.csv')
+	streamed_class = Ratings(ratings_file_name, stream=True, chunk_size=50, workers=workers)
+	assert ratings_report(streamed_class, 'movies.csv') == ratings_report(serial_class, 'movies.csv')
+
+@pytest.mark.parametrize('tags_file_name', ['tags.csv'])
+def test_tags_parallel(tags_file_name):
+	parallel_class, serial_class = Tags(tags_file_name, workers=3), Tags(tags_file_name)
+	assert parallel_class.columns() == serial_class.columns()
+	assert list(parallel_class.data) == list(serial_class.data)
+
+
+# to check the binary cache
+# -----------------------------------------------------
+
+def test_ratings_cache(tmp_path):
+	ratings_file_name = random_ratings(tmp_path)
+	cache_dir = str(tmp_path / 'cache')
+	parsed_class = Ratings(ratings_file_name, cache_dir=cache_dir)
+	cached_class = Ratings(ratings_file_name, cache_dir=cache_dir)
+	assert isinstance(cached_class.user_ids, memoryview)
+	assert cached_class.columns() == parsed_class.columns()
+	assert ratings_report(cached_class, 'movies.csv') == ratings_report(Ratings(ratings_file_name), 'movies.csv')
+	write_ratings(ratings_file_name, [[1, 1, '4.5', 1000]])
+	changed_class = Ratings(ratings_file_name, cache_dir=cache_dir)
+	assert list(changed_class.data) == [['1', '1', '4.5', '1000']]
+	assert isinstance(Ratings(ratings_file_name, cache_dir=cache_dir).user_ids, memoryview)
+
+@pytest.mark.parametrize('tags_file_name', ['tags.csv'])
+@pytest.mark.parametrize('movies_file_name', ['movies.csv'])
+def test_tags_and_movies_cache(tmp_path, tags_file_name, movies_file_name):
+	cache_dir = str(tmp_path / 'cache')
+	Tags(tags_file_name, cache_dir=cache_dir)
+	assert list(Tags(tags_file_name, cache_dir=cache_dir).data) == list(Tags(tags_file_name).data)
+	Movies(movies_file_name, cache_dir=cache_dir)
+	assert list(Movies(movies_file_name, cache_dir=cache_dir).data) == list(Movies(movies_file_name).data)
+
+@pytest.mark.parametrize('tags_file_name', ['tags.csv'])
+@pytest.mark.parametrize('movies_file_name', ['movies.csv'])
+def test_unwritable_cache(tmp_path, capsys, tags_file_name, movies_file_name):
+	ratings_file_name = random_ratings(tmp_path)
+	(tmp_path / 'notadir').write_text('')
+	cache_dir = str(tmp_path / 'notadir' / 'cache')
+	ratings_class = Ratings(ratings_file_name, cache_dir=cache_dir)
+	assert ratings_report(ratings_class, movies_file_name) == ratings_report(Ratings(ratings_file_name), movies_file_name)
+	assert len(ratings_class.get_neighbor_index(k=3)) > 0
+	assert list(Tags(tags_file_name, cache_dir=cache_dir).data) == list(Tags(tags_file_name).data)
+	movies_class = Movies(movies_file_name, cache_dir=cache_dir)
+	assert len(movies_class.movie_index) == len(Movies(movies_file_name).movie_index) > 0
+	output = capsys.readouterr().out
+	assert "There is no file" not in output
+	assert output.count("Could not write the") == 4
+
+
+# to check the fetching of the imdb pages
+# -----------------------------------------------------
+
+@pytest.mark.parametrize('links_file_name', ['links.csv'])
+def test_links_fetch(links_file_name, imdb_server):
+	links_class = Links(links_file_name, imdb_fetcher(imdb_server, workers=4))
+	imdb = links_class.get_imdb()
+	assert len(imdb) == 19
+	assert imdb[0] == ['1', 'Toy Story', 'John Lasseter', '30000000', '394436586', '81 min']
+	assert imdb[17] == ['18', 'Four Rooms', '', '4000000', '0', '98 min']
+	assert list(links_class.most_expensive(1).items()) == [('Cutthroat Island', '98000000')]
+
+@pytest.mark.parametrize('links_file_name', ['links.csv'])
+def test_links_fetch_cache(links_file_name, imdb_server, tmp_path):
+	cache_dir = str(tmp_path / 'cache')
+	fetched_class = Links(links_file_name, imdb_fetcher(imdb_server, cache_dir=cache_dir))
+	requests_count = len(imdb_server.requests)
+	cached_class = Links(links_file_name, imdb_fetcher(imdb_server, cache_dir=cache_dir))
+	assert len(imdb_server.requests) == requests_count
+	assert cached_class.get_imdb() == fetched_class.get_imdb()
+
+def test_links_fetch_retries(imdb_server):
+	imdb_server.failures['/title/tt0114709/'] = 2
+	assert imdb_fetcher(imdb_server).fetch(['0114709'])['0114709'][0] == 'Toy Story'
+	imdb_server.failures['/title/tt0114709/'] = 2
+	fetcher = imdb_fetcher(imdb_server, retries=1)
+	assert fetcher.fetch(['0114709', '0000000']) == {}
+	assert sorted(fetcher.failures) == ['0000000', '0114709']
+	fetcher = ImdbFetcher(base_url='http://127.0.0.1:99999/title/tt{}/', backoff=0, retries=3)
+	assert fetcher.fetch(['0114709', '0000000']) == {}
+	assert sorted(fetcher.failures) == ['0000000', '0114709']
+	assert fetcher.stats['requests'] == fetcher.stats['errors'] == 2
+
+@pytest.mark.parametrize('links_file_name', ['links.csv'])
+def test_links_lazy(links_file_name, imdb_server):
+	links_class = Links(links_file_name, imdb_fetcher(imdb_server))
+	assert imdb_server.requests == []
+	imdb = links_class.get_imdb([10, '6'])
+	assert [x[1] for x in imdb] == ['Heat', 'GoldenEye']
+	assert len(imdb_server.requests) == 2
+	assert links_class.get_details('10')[2] == 'Martin Campbell'
+	assert len(imdb_server.requests) == 2
+	links_class.top_directors(3)
+	assert len(imdb_server.requests) == 19
+	links_class.longest(3)
+	assert len(imdb_server.requests) == 19
+
+
+# to check the extraction of the imdb pages
+# -----------------------------------------------------
+
+def read_imdb_fixtures():
+	pages = []
+	for name in sorted(os.listdir(FIXTURES_DIR)):
+		with open(os.path.join(FIXTURES_DIR, name)) as f:
+			pages.append(f.read())
+	return pages
+
+def test_imdb_fast_parser():
+	for page in read_imdb_fixtures():
+		assert parse_imdb_page_fast(page) == parse_imdb_page_soup(page)
+
+def test_imdb_parser_fallback():
+	page = read_imdb_fixtures()[0].replace('<div class="title_wrapper">', '<div class="title_wrapper plot">')
+	assert parse_imdb_page_fast(page) is None
+	assert parse_imdb_page(page) == parse_imdb_page_soup(page)
+	assert parse_imdb_page(page)[0] == 'Ace Ventura: When Nature Calls'
+	assert parse_imdb_page('<html></html>') is None
+	page = read_imdb_fixtures()[0]
+	inline_txt = page.replace('<h4 class="inline">Budget:', '<h4 class="inline txt">Budget:')
+	assert parse_imdb_page_fast(inline_txt) == parse_imdb_page_soup(inline_txt)
+	assert parse_imdb_page_fast(inline_txt)[2] == '30000000'
+	nested = page.replace('<b>Director:</b>', '<div><b>Director:</b></div>')
+	assert parse_imdb_page_fast(nested) is None
+	assert parse_imdb_page(nested) == parse_imdb_page_soup(nested)
+	assert parse_imdb_page(nested)[1] == 'Steve Oedekerk'
+	outside = page.replace('<h4 class="inline">Budget:</h4>$30,000,000', '').replace(
+		'</body>', '<div class="txt-block"><h4 class="inline">Budget:</h4>$1</div></body>')
+	assert parse_imdb_page_fast(outside) == parse_imdb_page_soup(outside)
+	assert parse_imdb_page_fast(outside)[2] == '0'
+	unexpected = page.replace('<h4 class="inline">Budget:</h4>', '<h4 class="inline"><b>Budget:</b></h4>')
+	assert parse_imdb_page_fast(unexpected) is None
+	assert parse_imdb_page(unexpected) == parse_imdb_page_soup(unexpected)
+
+
+# to check the benchmark suite
+# -----------------------------------------------------
+
+def test_benchmarks_run(tmp_path):
+	from benchmarks.generate import generate
+	from benchmarks.run import measure, compare
+	generate(str(tmp_path), 3000, seed=1)
+	results = measure(str(tmp_path), repeat=2)
+	assert 'Ratings.Movies.top_by_ratings' in results and 'Links.top_cost_per_minute' in results
+	assert list(results)[0] == 'calibration'
+	assert all(result['seconds'] >= 0 and result['peak_bytes'] >= 0 for result in results.values())
+	assert len(Links(str(tmp_path / 'links.csv'), ImdbFetcher(cache_dir=str(tmp_path / 'cache'))).get_imdb()) > 0
+	assert compare(results, results, 0.5, 0.2) == []
+	slow = dict(results, Ratings={'seconds': 10.0, 'peak_bytes': 0})
+	assert compare(slow, {'Ratings': {'seconds': 1.0, 'peak_bytes': 0}}, 0.5, 0.2) == ['Ratings: 10.0000s against 1.0000s']
+	step = lambda seconds: {'seconds': seconds, 'peak_bytes': 0}
+	slower_machine = {'calibration': step(2.0), 'Ratings': step(10.0)}
+	assert compare(slower_machine, {'calibration': step(1.0), 'Ratings': step(6.0)}, 0.5, 0.2) == []
+	assert compare(slower_machine, {'calibration': step(1.0), 'Ratings': step(3.0)}, 0.5, 0.2) == ['Ratings: 10.0000s against 6.0000s']
+	assert compare({'calibration': step(0.5), 'Ratings': step(10.0)}, {'calibration': step(1.0), 'Ratings': step(8.0)}, 0.5, 0.2) == []
+	assert compare({'Links': step(0.0008)}, {'Links': step(0.0004)}, 0.5, 0.2) == []
+	assert compare({'Links': step(0.003)}, {'Links': step(0.0004)}, 0.5, 0.2) == ['Links: 0.0030s against 0.0004s']
+
+
+# to check the search of the tags
+# -----------------------------------------------------
+
+@pytest.mark.parametrize('tags_file_name', ['tags.csv'])
+@pytest.mark.parametrize('word', ['', 'e', 'Os', 'Osc', 'so bad', 'tense', 'xyz'])
+def test_tags_with_index(tags_file_name, word):
+	tags_class = Tags(tags_file_name)
+	assert tags_class.tags_with(word) == sorted(set(x[2] for x in tags_class.data if word in x[2]))
+	assert tags_class.get_index() is tags_class.get_index()
+
+@pytest.mark.parametrize('tags_file_name', ['tags.csv'])
+def test_tags_with_options(tags_file_name):
+	tags_class = Tags(tags_file_name)
+	assert tags_class.tags_with('oscar') == []
+	assert tags_class.tags_with('oscar', ignore_case=True) == ['Oscar (Best Supporting Actress)']
+	assert tags_class.tags_with('dialog') == ['great dialogue']
+	assert tags_class.tags_with('dialog', whole_word=True) == []
+	assert tags_class.tags_with('bad', whole_word=True) == ["so bad it's good"]
+
+def test_tags_with_unicode_case(tmp_path):
+	tags = ['ΣΑΣΑ', 'ΟΔΟΣ ΣΑΣ', 'İstanbul', 'Straße', 'STRASSE']
+	with open(tmp_path / 'tags.csv', 'w', encoding='utf-8') as f:
+		f.write('userId,movieId,tag,timestamp\n' + ''.join(f'1,2,{tag},1000\n' for tag in tags))
+	tags_class = Tags(str(tmp_path / 'tags.csv'))
+	for word in ['ΣΑΣ', 'σας', 'ΟΣ Σ', 'ος σ', 'İst', 'i̇st', 'ist', 'raß', 'RASS', 'rass']:
+		for ignore_case in [False, True]:
+			folded = (lambda text: text.lower()) if ignore_case else (lambda text: text)
+			expected = sorted(tag for tag in tags if folded(word) in folded(tag))
+			assert tags_class.tags_with(word, ignore_case=ignore_case) == expected
+	assert tags_class.tags_with('ΣΑΣ') == ['ΟΔΟΣ ΣΑΣ', 'ΣΑΣΑ']
+
+
+# to check the vocabulary of the tags
+# -----------------------------------------------------
+
+@pytest.mark.parametrize('tags_file_name', ['tags.csv'])
+def test_tags_vocabulary(tags_file_name):
+	tags_class = Tags(tags_file_name)
+	vocabulary = tags_class.vocabulary
+	assert len(tags_class.tag_ids) == 19 and len(vocabulary) == 17
+	tag_id = vocabulary.index["so bad it's good"]
+	assert (vocabulary.counts[tag_id], vocabulary.words[tag_id], vocabulary.lengths[tag_id]) == (2, 4, 16)
+	assert tags_class.data[4] == ['4', '7569', "so bad it's good", '1573943455']
+	assert tags_class.most_popular(2) == OrderedDict([("so bad it's good", 2), ('tense', 2)])
+	assert tags_class.most_words(2) == OrderedDict([("so bad it's good", 4), ('Oscar (Best Supporting Actress)', 4)])
+	assert tags_class.longest(2) == ['Oscar (Best Supporting Actress)', 'artificial intelligence']
+
+def test_tags_commas(tmp_path):
+	with open(tmp_path / 'tags.csv', 'w') as f:
+		f.write('userId,movieId,tag,timestamp\n1,2,"dark, funny",1000\n3,2,dark,1001\n4,2,dark, sad,1002\n')
+	tags_class = Tags(str(tmp_path / 'tags.csv'))
+	assert list(tags_class.timestamps) == [1000, 1001, 1002]
+	assert tags_class.tags_with('dark') == ['dark', 'dark, funny', 'dark, sad']
+
+
+# to check the incremental updates
+# -----------------------------------------------------
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_ratings_append_and_tail(tmp_path, stream):
+	full_file_name = random_ratings(tmp_path)
+	with open(full_file_name) as f:
+		lines = f.readlines()
+	growing_file_name = str(tmp_path / 'growing.csv')
+	with open(growing_file_name, 'w') as f:
+		f.writelines(lines[:1001])
+	ratings_class = Ratings(growing_file_name, stream=stream)
+	ratings_report(ratings_class, 'movies.csv')
+	ratings_class.append(line.strip().split(',') for line in lines[1001:1501])
+	with open(growing_file_name, 'a') as f:
+		f.writelines(lines[1001:])
+	offset = ratings_class.tail(offset=os.path.getsize(growing_file_name) - len(''.join(lines[1501:])))
+	assert offset == os.path.getsize(growing_file_name)
+	assert ratings_report(ratings_class, 'movies.csv') == ratings_report(Ratings(full_file_name), 'movies.csv')
+	with open(growing_file_name, 'a') as f:
+		f.write('1,1,4.0,1000\n2,1,3.0')
+	ratings_class.tail()
+	assert sum(ratings_class.get_summary().movies.counts) == len(lines)
+
+@pytest.mark.parametrize('tags_file_name', ['tags.csv'])
+def test_tags_append_and_tail(tmp_path, tags_file_name):
+	with open(tags_file_name) as f:
+		lines = f.readlines()
+	growing_file_name = str(tmp_path / 'tags.csv')
+	with open(growing_file_name, 'w') as f:
+		f.writelines(lines[:10])
+	tags_class = Tags(growing_file_name)
+	assert tags_class.tags_with('Osc') == []
+	tags_class.append([line.strip().split(',') for line in lines[10:15]])
+	with open(growing_file_name, 'a') as f:
+		f.writelines(lines[10:] + ['\n'])
+	tags_class.tail(offset=os.path.getsize(growing_file_name) - len(''.join(lines[15:])) - 1)
+	version = tags_class.version
+	tags_class.tail()
+	assert tags_class.version == version
+	full_class = Tags(tags_file_name)
+	assert list(tags_class.data) == list(full_class.data)
+	assert tags_class.tags_with('Osc') == full_class.tags_with('Osc') == ['Oscar (Best Supporting Actress)']
+	assert tags_class.most_popular(3) == full_class.most_popular(3)
+
+
+# to check the percentiles of the ratings
+# -----------------------------------------------------
+
+def test_ratings_percentiles(tmp_path):
+	import random, statistics
+	generator = random.Random(3)
+	rows = [[1, 10 + i % 3, generator.randint(1, 10) / 2, 1000 + i] for i in range(301)]
+	ratings_class = Ratings(write_ratings(tmp_path / 'ratings.csv', rows))
+	movies = ratings_class.get_summary().movies
+	for movie_id in (10, 11, 12):
+		values = sorted(row[2] for row in rows if row[1] == movie_id)
+		group = movies.index[movie_id]
+		assert movies.median(group) == statistics.median(values)
+		for fraction in (0.0, 0.1, 0.9, 0.99, 1.0):
+			position = fraction * (len(values) - 1)
+			lower = int(position)
+			upper = min(lower + 1, len(values) - 1)
+			expected = values[lower] + (values[upper] - values[lower]) * (position - lower)
+			assert abs(movies.quantile(group, fraction) - expected) < 1e-12
+	users_class = ratings_class.Users(ratings_class)
+	assert users_class.valuers_with_ratings('p100') == OrderedDict([('1', 5.0)])
+	assert list(users_class.valuers_with_ratings('p0').values()) == [0.5]
+	with pytest.raises(ValueError):
+		users_class.valuers_with_ratings('mode')
+
+
+# to check the variances of the ratings
+# -----------------------------------------------------
+
+def test_ratings_variances(tmp_path):
+	import statistics
+	ratings_file_name = random_ratings(tmp_path)
+	ratings_class = Ratings(ratings_file_name)
+	users = ratings_class.get_summary().users
+	variances = users.variances()
+	for group, user_id in enumerate(users.keys):
+		values = [code / 2 for key, code in zip(ratings_class.user_ids, ratings_class.rating_codes) if key == user_id]
+		assert abs(variances[group] - statistics.variance(values)) < 1e-12
+		assert variances[group] == users.variance(group)
+	write_ratings(ratings_file_name, [[1, 1, '5.0', 1000], [2, 2, '1.0', 1000], [2, 2, '4.0', 1000],
+		[2, 3, '2.0', 1000], [2, 3, '3.0', 1000], [2, 3, '4.0', 1000]])
+	ratings_class = Ratings(ratings_file_name)
+	movies_class = ratings_class.Movies('movies.csv', ratings_class)
+	assert list(movies_class.top_controversial(3).values()) == [5.0, 4.5, 1.0]
+	assert list(movies_class.top_controversial(3, min_count=3).values()) == [1.0]
+	users_class = ratings_class.Users(ratings_class)
+	assert list(users_class.top_controversial_valuers(2, min_count=2)) == ['2']
+
+
+# to check the time ranges of the ratings
+# -----------------------------------------------------
+
+def test_ratings_dist_by_year_calendar(tmp_path):
+	ratings_class = Ratings(write_ratings(tmp_path / 'ratings.csv', [
+		[1, 1, '4.0', 1609459199], [1, 2, '3.0', 1609459200], [2, 1, '5.0', 946684800], [2, 3, '1.0', 951782400]]))
+	movies_class = ratings_class.Movies('movies.csv', ratings_class)
+	assert movies_class.dist_by_year() == OrderedDict([(2000, 2), (2020, 1), (2021, 1)])
+	assert movies_class.dist_by_month() == OrderedDict([('2000-01', 1), ('2000-02', 1), ('2020-12', 1), ('2021-01', 1)])
+	assert list(movies_class.dist_by_day()) == ['2000-01-01', '2000-02-29', '2020-12-31', '2021-01-01']
+	assert movies_class.dist_by_year(end=1609459200) == OrderedDict([(2000, 2), (2020, 1)])
+
+def test_ratings_time_ranges(tmp_path):
+	import datetime
+	ratings_file_name = random_ratings(tmp_path, count=9000)
+	ratings_class = Ratings(ratings_file_name)
+	movies_class = ratings_class.Movies('movies.csv', ratings_class)
+	rows = list(ratings_class.data)
+	assert movies_class.dist_by_year(0, 2 ** 40) == movies_class.dist_by_year()
+	assert movies_class.dist_by_day(0, None) == movies_class.dist_by_day()
+	assert list(movies_class.dist_by_year()) == sorted(movies_class.dist_by_year())
+	for start, end in [(800000000, 1600000001), (1000000000, 1200000000), (1234567890, 1234567890), (None, 900000000)]:
+		selected = [row for row in rows if (start is None or int(row[3]) >= start) and int(row[3]) < end]
+		days = OrderedDict()
+		for row in sorted(selected, key=lambda row: int(row[3])):
+			day = datetime.datetime.fromtimestamp(int(row[3]), datetime.timezone.utc).strftime('%Y-%m-%d')
+			days[day] = days.get(day, 0) + 1
+		assert movies_class.dist_by_day(start, end) == days
+		assert sum(movies_class.dist_by_year(start, end).values()) == len(selected)
+		ratings = {}
+		for row in selected:
+			ratings[row[2]] = ratings.get(row[2], 0) + 1
+		assert movies_class.dist_by_rating(start, end) == OrderedDict(sorted(ratings.items()))
+		top = movies_class.top_by_num_of_ratings(5, start, end)
+		counts = {}
+		for row in selected:
+			title = movies_class.index.get_title(int(row[1]))
+			counts[title] = counts.get(title, 0) + 1
+		assert list(top.values()) == sorted(counts.values(), reverse=True)[:5]
+		assert all(counts[title] == count for title, count in top.items())
+	time_index, version = ratings_class.get_time_index(), ratings_class.version
+	assert ratings_class.tail() == ratings_class.offset
+	assert ratings_class.version == version and ratings_class.time_index is time_index
+	ratings_class.append([[1, 1, '5.0', 1600000000]])
+	assert movies_class.dist_by_rating(1600000000, None) == OrderedDict([('5.0', 1)])
+	assert ratings_class.get_time_index() is time_index
+	ratings_class.append([[1, 1, '0.5', 1000]])
+	assert movies_class.dist_by_rating(None, 1001) == OrderedDict([('0.5', 1)])
+	assert ratings_class.get_time_index() is not time_index
+	streamed_class = Ratings(ratings_file_name, stream=True)
+	streamed_movies = streamed_class.Movies('movies.csv', streamed_class)
+	assert streamed_movies.dist_by_month() == movies_class.dist_by_month(800000000, 1600000000)
+	with pytest.raises(ValueError):
+		streamed_movies.dist_by_year(start=1000000000)
+
+
+# to check the similar movies
+# -----------------------------------------------------
+
+def get_similarities(rows, movie_id, metric):
+	import math
+	ratings = {}
+	for user_id, other_id, rating, _ in rows:
+		ratings.setdefault(int(other_id), {})[int(user_id)] = 1 if metric == "common" else float(rating) * 2
+	if metric == "pearson":
+		for movie_ratings in ratings.values():
+			mean = sum(movie_ratings.values()) / len(movie_ratings)
+			movie_ratings.update((user_id, rating - mean) for user_id, rating in movie_ratings.items())
+	def norm(movie_ratings):
+		return 1 if metric == "common" else math.sqrt(sum(rating * rating for rating in movie_ratings.values()))
+	similarities = {}
+	for other_id, other_ratings in ratings.items():
+		dot = sum(rating * other_ratings[user_id] for user_id, rating in ratings[movie_id].items() if user_id in other_ratings)
+		if other_id != movie_id and dot > 1e-6:
+			similarities[other_id] = dot / norm(ratings[movie_id]) / norm(other_ratings)
+	return similarities
+
+@pytest.mark.parametrize('metric', ['cosine', 'pearson', 'common'])
+def test_similar_movies(tmp_path, metric):
+	ratings_file_name = random_ratings(tmp_path, count=600)
+	ratings_class = Ratings(ratings_file_name, cache_dir=str(tmp_path / 'cache'))
+	rows = list(ratings_class.data)
+	index = ratings_class.get_neighbor_index(metric, k=5)
+	for movie_id in range(1, 20):
+		expected = get_similarities(rows, movie_id, metric)
+		neighbors = index.get_neighbors(movie_id)
+		assert len(neighbors) == min(5, len(expected))
+		assert [similarity for _, similarity in neighbors] == pytest.approx(sorted(expected.values(), reverse=True)[:5], abs=1e-5)
+		assert all(expected[other_id] == pytest.approx(similarity, abs=1e-5) for other_id, similarity in neighbors)
+	parallel_class = Ratings(ratings_file_name, workers=2)
+	assert parallel_class.get_neighbor_index(metric, k=5).get_neighbors(3) == index.get_neighbors(3)
+	cached_index = Ratings(ratings_file_name, cache_dir=str(tmp_path / 'cache')).get_neighbor_index(metric, k=3)
+	assert isinstance(cached_index.neighbors, memoryview)
+	assert cached_index.get_neighbors(3, 3) == index.get_neighbors(3, 3)
+	movies_class = ratings_class.Movies('movies.csv', ratings_class)
+	similar = movies_class.similar_movies(3, 4, metric)
+	assert list(similar.values()) == [similarity for _, similarity in index.get_neighbors(3, 4)]
+	assert list(similar) == [movies_class.index.get_title(other_id) for other_id, _ in index.get_neighbors(3, 4)]
+	ratings_class.append([[100, 3, '5.0', 1000], [100, 1, '0.5', 1000], [100, 999, '5.0', 1000]])
+	index = ratings_class.get_neighbor_index(metric, k=5)
+	expected = get_similarities(rows + [[100, 3, '5.0', 1000], [100, 1, '0.5', 1000], [100, 999, '5.0', 1000]], 3, metric)
+	assert index.get_neighbors(3, 5)[0][1] == pytest.approx(max(expected.values()), abs=1e-5)
+	assert list(movies_class.similar_movies(3, 4, metric).values()) == [similarity for _, similarity in index.get_neighbors(3, 4)]
+	assert movies_class.similar_movies(424242) == OrderedDict()
+	assert len(movies_class.similar_movies(3, 100, metric)) <= 5
+	assert ratings_class.get_neighbor_index(metric) is index
+	with pytest.raises(ValueError):
+		Ratings(ratings_file_name, stream=True).get_neighbor_index(metric)
+
+
+# to check the genres of the movies
+# -----------------------------------------------------
+
+def test_movies_genres(tmp_path):
+	movies_file_name = tmp_path / 'movies.csv'
+	movies_file_name.write_text('movieId,title,genres\n'
+		'1,Toy Story (1995),Adventure|Animation|Children|Comedy\n'
+		'2,"American President, The (1995)",Comedy|Drama|Romance\n'
+		'3,Heat,Action|Crime\n'
+		'4,Sabrina (1995),Comedy|Romance\n')
+	movies_class = Movies(str(movies_file_name))
+	assert movies_class.dist_by_release() == OrderedDict([('1995', 3), ('(year not specified)', 1)])
+	assert list(movies_class.data[1]) == ['2', 'American President, The (1995)', ['Comedy', 'Drama', 'Romance']]
+	assert movies_class.dist_by_genres()['Comedy'] == 3
+	assert list(movies_class.most_genres(2).values()) == [4, 3]
+	assert movies_class.with_genres(['Comedy', 'Romance']) == ['American President, The (1995)', 'Sabrina (1995)']
+	assert movies_class.with_genres(['Crime', 'Animation'], any_genre=True) == ['Toy Story (1995)', 'Heat']
+	assert movies_class.with_genres(['Comedy', 'Western']) == []
+	assert movies_class.genres_with('Comedy') == OrderedDict([('Romance', 2), ('Adventure', 1), ('Animation', 1),
+		('Children', 1), ('Drama', 1)])
+	assert movies_class.genres_with('Western') == OrderedDict()
+
+@pytest.mark.parametrize('movies_file_name', ['movies.csv'])
+def test_movies_ratings(tmp_path, movies_file_name):
+	ratings_class = Ratings(random_ratings(tmp_path))
+	movies_class = Movies(movies_file_name)
+	joined = MoviesRatings(movies_class, ratings_class)
+	movie_rows = {int(row[0]): row for row in movies_class.data}
+	genres, years = {}, {}
+	for row in ratings_class.data:
+		movie_row = movie_rows[int(row[1])]
+		for genre in movie_row[2]:
+			genres.setdefault(genre, []).append(float(row[2]))
+		year = re.search(r'\((\d{4})\)', movie_row[1])
+		years.setdefault(year.group(1) if year else '(year not specified)', []).append(float(row[2]))
+	by_genres = joined.ratings_by_genres()
+	assert set(by_genres) == set(genres)
+	assert all(abs(by_genres[genre] - sum(values) / len(values)) < 1e-9 for genre, values in genres.items())
+	assert list(by_genres.values()) == sorted(by_genres.values(), reverse=True)
+	by_release = joined.ratings_by_release('median')
+	assert list(by_release) == sorted(years)
+	assert sum(joined.genre_dist_by_rating('Comedy').values()) == len(genres['Comedy'])
+	assert joined.genre_dist_by_rating('Western') == OrderedDict()
+	assert sum(joined.release_dist_by_rating(1995).values()) == len(years['1995'])
+	matrix = joined.genres_matrix()
+	assert matrix['Comedy']['Comedy'] == movies_class.dist_by_genres()['Comedy']
+	assert matrix['Comedy'] == OrderedDict((genre, matrix[genre]['Comedy']) for genre in matrix)
+	assert matrix['Comedy']['Romance'] == len(movies_class.with_genres(['Comedy', 'Romance']))
+	comedies = joined.genre_dist_by_rating('Comedy')
+	ratings_class.append([[9999, 1, '0.5', 1000]])
+	assert joined.genre_dist_by_rating('Comedy') == OrderedDict(comedies, **{'0.5': comedies.get('0.5', 0) + 1})
+	assert sum(joined.release_dist_by_rating(1995).values()) == len(years['1995']) + 1
+	assert joined.ratings_by_genres()['Comedy'] < by_genres['Comedy']
+	assert joined.genres_matrix() == matrix
+
+
+# to check the movie index shared by the classes
+# -----------------------------------------------------
+
+@pytest.mark.parametrize('movies_file_name', ['movies.csv'])
+def test_movie_index(tmp_path, movies_file_name):
+	movies_class = Movies(movies_file_name)
+	ratings_class = Ratings(write_ratings(tmp_path / 'ratings.csv', [
+		[1, 999999, '4.0', 1000], [2, 999999, '2.0', 1001], [3, 999999, '3.5', 1002],
+		[1, 1, '1.5', 1004], [1, 2, '0.5', 1005], [2, 2, '4.5', 1006], [3, -1, '5.0', 1007]]))
+	ratings_movies = ratings_class.Movies(movies_file_name, ratings_class)
+	assert ratings_movies.index is movies_class.movie_index
+	index = movies_class.movie_index
+	assert index.get_title(1) == 'Toy Story (1995)'
+	assert index.get_title(999999) is None and index.get_title(-1) is None
+	assert list(index.get_dense_ids([2, 999999, 1])) == [1, -1, 0]
+	assert ratings_movies.top_by_num_of_ratings(2) == OrderedDict([('Jumanji (1995)', 2), ('Toy Story (1995)', 1)])
+	assert list(ratings_movies.top_by_ratings(5)) == ['Jumanji (1995)', 'Toy Story (1995)']
+	assert list(ratings_movies.top_controversial(5)) == ['Jumanji (1995)', 'Toy Story (1995)']
+	with open(tmp_path / 'negative.csv', 'w') as f:
+		f.write('movieId,title,genres\n1,One (1990),Drama\n5,Five (1995),Drama\n-1,Minus One (1991),Drama\n')
+	negative_class = Movies(str(tmp_path / 'negative.csv'))
+	assert negative_class.malformed.counts == {'value': 1}
+	assert negative_class.movie_index.get_title(5) == 'Five (1995)'
+	assert MovieIndex([1, 5, -1], ['One', 'Five', 'Minus One']).get_title(5) == 'Five'
+
+
+# to check the memoization of the results
+# -----------------------------------------------------
+
+@pytest.mark.parametrize('tags_file_name', ['tags.csv'])
+def test_memoized_results(tmp_path, tags_file_name):
+	tags_class = Tags(tags_file_name)
+	most_popular = tags_class.most_popular(20)
+	assert tags_class.most_popular(n=20) == most_popular
+	assert tags_class.memo.results[('most_popular',)][0] == 20
+	assert tags_class.most_popular(5) == OrderedDict(list(most_popular.items())[:5])
+	assert len(tags_class.memo.results) == 1
+	tags_class.most_popular(5).clear()
+	assert tags_class.most_popular(20) == most_popular
+	assert tags_class.most_popular(-1) == Tags(tags_file_name).most_popular(-1)
+	assert tags_class.memo.results[('most_popular',)][0] == 20
+	tags_class.append([[1, 1, 'classic', 1000]] * 100)
+	assert tags_class.most_popular(1) == OrderedDict([('classic', most_popular['classic'] + 100)])
+	ratings_class = Ratings(random_ratings(tmp_path))
+	users_class = ratings_class.Users(ratings_class)
+	valuers = users_class.top_valuers()
+	assert users_class.top_valuers() is not valuers
+	ratings_class.append([[1000, 1, '5.0', 1000]])
+	assert users_class.top_valuers()['1000'] == 1
+	ratings_class.get_summary().users.add(1001, 10)
+	assert '1001' not in users_class.top_valuers()
+	clear_memo(users_class)
+	assert users_class.top_valuers()['1001'] == 1
+
+
+# to check the instrumentation
+# -----------------------------------------------------
+
+@pytest.mark.parametrize('links_file_name', ['links.csv'])
+def test_instrumentation(tmp_path, links_file_name, imdb_server):
+	import json
+	import io
+	sink = StatsSink()
+	ratings_file_name = random_ratings(tmp_path)
+	with instrumentation(sink, memory=True):
+		ratings_class = Ratings(ratings_file_name)
+		users_class = ratings_class.Users(ratings_class)
+		users_class.top_controversial_valuers(10)
+		users_class.top_controversial_valuers(5)
+	ratings_class.get_summary()
+	assert [event["name"] for event in sink.events] == ['Ratings.__init__', 'Ratings.get_summary',
+		'Ratings.Users.top_controversial_valuers', 'Ratings.Users.top_controversial_valuers']
+	assert [event["cached"] for event in sink.events] == [False, False, False, True]
+	assert all(event["dataset_rows"] == 2000 for event in sink.events)
+	users = len(ratings_class.get_summary().users)
+	assert [event["rows"] for event in sink.events] == [2000, 2000, users, 0]
+	assert sink.events[0]["peak_bytes"] > 0 and "peak_bytes" not in sink.events[1]
+	summary = sink.summary()
+	assert summary['Ratings.Users.top_controversial_valuers']['calls'] == 2
+	assert summary['Ratings.Users.top_controversial_valuers']['cached'] == 1
+	assert summary['Ratings.Users.top_controversial_valuers']['rows'] == users
+	sink = StatsSink()
+	with instrumentation(sink):
+		movies_class = ratings_class.Movies('movies.csv', ratings_class)
+		movies_class.dist_by_month(800000000, 1000000000)
+		movies_class.top_by_ratings(5)
+		Tags('tags.csv').most_popular(3)
+	in_range = sum(800000000 <= timestamp < 1000000000 for timestamp in ratings_class.timestamps)
+	rows = {event["name"]: event["rows"] for event in sink.events}
+	assert rows['Ratings.get_time_index'] == 2000 and rows['Ratings.Movies.dist_by_month'] == in_range
+	assert rows['Ratings.Movies.top_by_ratings'] == len(ratings_class.get_summary().movies)
+	assert rows['Tags.__init__'] == 19 and rows['Tags.most_popular'] == 17
+	events_file_name = str(tmp_path / 'events.jsonl')
+	cache_dir = str(tmp_path / 'cache')
+	with instrumentation(JsonLinesSink(events_file_name)):
+		Links(links_file_name, imdb_fetcher(imdb_server, cache_dir=cache_dir)).get_imdb([1, 2])
+		links_class = Links(links_file_name, imdb_fetcher(imdb_server, cache_dir=cache_dir))
+		links_class.get_imdb([1, 2, 3])
+	with open(events_file_name) as f:
+		events = [json.loads(line) for line in f]
+	fetches = [event for event in events if event["name"] == 'ImdbFetcher.fetch']
+	assert [(event["rows"], event["cache_hits"], event["requests"]) for event in fetches] == [(2, 0, 2), (3, 2, 1)]
+	assert fetches[1]["cache_hit_ratio"] == 2 / 3 and fetches[1]["bytes"] > 0
+	assert sum(event["name"] == 'ImdbFetcher.get_page' for event in events) == 3
+	assert links_class.fetcher.stats["requests"] == 1 and links_class.fetcher.cache_hit_ratio() == 2 / 3
+	stream = io.StringIO()
+	with profiled(stream=stream, limit=5):
+		Tags('tags.csv').most_popular(10)
+	assert 'function calls' in stream.getvalue()
+	with profiled(path=str(tmp_path / 'tags.prof')):
+		Tags('tags.csv').most_popular(10)
+	assert os.path.getsize(tmp_path / 'tags.prof') > 0
+
+
+# to check the reading of malformed and quoted files
+# -----------------------------------------------------
+
+def test_ingestion_malformed(tmp_path):
+	ratings_file_name = random_ratings(tmp_path)
+	with open(ratings_file_name) as f:
+		text = f.read()
+	assert ''.join(get_generator_blocks(ratings_file_name, block_size=7)) == text[text.index('\n') + 1:]
+	ratings_class = Ratings(ratings_file_name)
+	for chunk_size in [5, 97, 4096]:
+		assert list(Ratings(ratings_file_name, chunk_size=chunk_size).data) == list(ratings_class.data)
+	with open(tmp_path / 'broken.csv', 'w', newline='') as f:
+		f.write('userId,movieId,rating,timestamp\r\n1,1,4.0,1000\r\n2,1,x,1001\r\n\r\n3,1,3,1002\r\n4,1\r\n'
+			'5,1,9.5,1003\r\n6,99999999999,1.0,1004\r\n7,2,0.5,1005,extra\r\n8,2,"2.5",1006')
+	broken_class = Ratings(str(tmp_path / 'broken.csv'))
+	assert list(broken_class.data) == [['1', '1', '4.0', '1000'], ['3', '1', '3.0', '1002'], ['8', '2', '2.5', '1006']]
+	assert broken_class.malformed.counts == {'value': 3, 'fields': 2}
+	assert broken_class.malformed.examples[0] == ['2', '1', 'x', '1001']
+	write_ratings(tmp_path / 'shifted.csv', [[1, 2, '3.0', 4, 5], [1, 2, 3]])
+	shifted_class = Ratings(str(tmp_path / 'shifted.csv'))
+	assert list(shifted_class.data) == [] and shifted_class.malformed.counts == {'fields': 2}
+	write_ratings(tmp_path / 'stars.csv', [[1, 2, '3.3', 4], [1, 2, '4.25', 5], [1, 2, '4.5', 6], [1, 2, 'nan', 7]])
+	stars_class = Ratings(str(tmp_path / 'stars.csv'))
+	assert list(stars_class.data) == [['1', '2', '4.5', '6']] and stars_class.malformed.counts == {'value': 3}
+	with pytest.raises(ValueError):
+		stars_class.append([[1, 3, '5.0', 8], [1, 2, '3.3', 9]])
+	assert stars_class.rows == 1
+	with open(tmp_path / 'tags.csv', 'w') as f:
+		f.write('userId,movieId,tag,timestamp\n1,2,funny,1000\n1,2\n1,x,sad,1001\n2,3,"quoted ""tag""",1002\n')
+	tags_class = Tags(str(tmp_path / 'tags.csv'))
+	assert list(tags_class.data) == [['1', '2', 'funny', '1000'], ['2', '3', 'quoted "tag"', '1002']]
+	assert len(tags_class.malformed) == 2
+	with open(tmp_path / 'shifted_tags.csv', 'w') as f:
+		f.write('userId,movieId,tag,timestamp\n1,2,a,3,4\n5,6,7\n')
+	shifted_class = Tags(str(tmp_path / 'shifted_tags.csv'))
+	assert list(shifted_class.data) == [['1', '2', 'a,3', '4']] and shifted_class.malformed.counts == {'fields': 1}
+	with open(tmp_path / 'movies.csv', 'w') as f:
+		f.write('movieId,title,genres\n1,"Heat, The (1995)",Action|Crime\nx,Bad (1990),Drama\n2,No genres\n')
+	movies_class = Movies(str(tmp_path / 'movies.csv'))
+	assert list(movies_class.data) == [['1', 'Heat, The (1995)', ['Action', 'Crime']]]
+	assert movies_class.malformed.counts == {'value': 1, 'fields': 1}
+	with open(tmp_path / 'links.csv', 'w') as f:
+		f.write('movieId,imdbId,tmdbId\n1,0114709,862\n2,0113497,\n3,0113228\n4,,15602\n5\n')
+	links_class = Links(str(tmp_path / 'links.csv'), ImdbFetcher())
+	assert links_class.links == OrderedDict([('1', '0114709'), ('2', '0113497'), ('3', '0113228')])
+	assert links_class.malformed.counts == {'value': 1, 'fields': 1}
+
+
+# to check the query server
+# -----------------------------------------------------
+
+def query(connection, method, path, body=None):
+	import json
+	connection.request(method, path, body=body and json.dumps(body))
+	response = connection.getresponse()
+	return response.status, json.loads(response.read())
+
+def test_query_server(tmp_path):
+	import asyncio
+	import http.client
+	objects = load_dataset('ratings.csv', 'tags.csv', 'movies.csv', cache_dir=str(tmp_path / 'cache'))
+	assert isinstance(objects['movies'].movie_ids, memoryview)
+	ratings_class = objects['ratings.movies'].ratings
+	assert ratings_class.time_index is not None and list(ratings_class.neighbor_indexes) == ['cosine']
+	sock = get_server_socket('127.0.0.1', 0)
+	threading.Thread(target=asyncio.run, args=(QueryServer(objects).run(sock),), daemon=True).start()
+	connection = http.client.HTTPConnection('127.0.0.1', sock.getsockname()[1])
+	assert query(connection, 'GET', '/')[1]['result']['tags'] == list(SERVER_METHODS['tags'])
+	tags_class = Tags('tags.csv')
+	assert query(connection, 'GET', '/tags/most_popular?n=3') == (200, {'result': tags_class.most_popular(3)})
+	assert query(connection, 'GET', '/tags/tags_with?word=dark&ignore_case=true')[1]['result'] == tags_class.tags_with('dark', True)
+	assert query(connection, 'POST', '/movies/with_genres', {'args': [['Comedy', 'Romance']]})[1]['result'] == \
+		Movies('movies.csv').with_genres(['Comedy', 'Romance'])
+	assert query(connection, 'GET', '/ratings.movies/dist_by_year')[1]['result'] == \
+		{str(year): count for year, count in objects['ratings.movies'].dist_by_year().items()}
+	assert query(connection, 'GET', '/tags/append')[0] == 404
+	assert query(connection, 'GET', '/nothing/most_popular')[0] == 404
+	assert query(connection, 'GET', '/tags/most_popular?m=3')[0] == 400
+	for word in ['1984', 'null', '[1]']:
+		assert query(connection, 'GET', '/tags/tags_with?word=' + word) == (200, {'result': tags_class.tags_with(word)})
+	assert query(connection, 'GET', '/movies/with_genres?genres=Comedy,Romance')[1]['result'] == \
+		Movies('movies.csv').with_genres(['Comedy', 'Romance'])
+	assert query(connection, 'GET', '/tags/tags_with?word=a&whole_word=maybe')[0] == 400
+	assert query(connection, 'POST', '/movies_ratings/release_dist_by_rating', {'args': [1e400]})[0] == 500
+	assert query(connection, 'POST', '/tags/most_popular', [3])[0] == 400
+	assert query(connection, 'GET', '/tags/most_popular?n=2')[0] == 200
+	connection.close()
+
+def test_query_server_workers(tmp_path):
+	import subprocess
+	import sys
+	import http.client
+	server = subprocess.Popen([sys.executable, 'movielens_analysis.py', '--port', '0', '--workers', '2',
+		'--cache-dir', str(tmp_path / 'cache')], stdout=subprocess.PIPE, text=True)
+	try:
+		port = int(re.search(r':(\d+) ', server.stdout.readline()).group(1))
+		connections = [http.client.HTTPConnection('127.0.0.1', port) for _ in range(4)]
+		for connection in connections:
+			assert query(connection, 'GET', '/tags/most_words?n=2') == (200, {'result': Tags('tags.csv').most_words(2)})
+	finally:
+		server.terminate()
+		assert server.wait(10) == 0
+
+
+# to check the import time
+# -----------------------------------------------------
+
+IMPORT_BUDGET_SECONDS = 0.2
+LAZY_MODULES = ['requests', 'bs4', 'urllib3', 'asyncio', 'numpy', 'logging', 'tracemalloc', 'argparse']
+
+def get_import_times(statement):
+	import subprocess
+	import sys
+	output = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement], capture_output=True, text=True,
+		check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stderr
+	times = {}
+	for line in output.splitlines():
+		match = re.fullmatch(r'import time:\s*(\d+) \|\s*(\d+) \| ( *)(\S+)', line)
+		if match:
+			times[match.group(4)] = int(match.group(2)) / 1e6
+	return times
+
+def test_import_time():
+	times = get_import_times('import movielens_analysis')
+	assert [module for module in LAZY_MODULES if module in times] == []
+	assert min(get_import_times('import movielens_analysis')['movielens_analysis'] for _ in range(3)) < IMPORT_BUDGET_SECONDS
+	assert 'bs4' in get_import_times('import movielens_analysis; movielens_analysis.parse_imdb_page_soup("")')